@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmark every bundled conversion config on corpora of different shapes.
+#
+# Each config is measured in a fresh process, so the load time is a cold
+# load and the peak RSS belongs to that config alone. Results are printed
+# as a table and can be saved as a JSON baseline to compare later runs with.
+#
+#   python3 benchmark/run.py --output baseline.json
+#   python3 benchmark/run.py --compare baseline.json
+#   python3 benchmark/run.py -c s2twp -c t2s --engine tree
+
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+CONFIG_DIRECTORY = os.path.join(ROOT, 'opencc', 'config')
+CORPUS_DIRECTORY = os.path.join(ROOT, 'test', 'corpus')
+
+SEED = 20160101
+# A change of more than this fraction is reported by --compare
+THRESHOLD = 0.10
+
+SEPARATORS = '，。、；：？！「」（）—… '
+ASCII_WORDS = ['GET', '/api/v1/items', 'status=200', 'latency=12ms', 'user_id=42',
+               'INFO', 'WARN', 'https://example.com/index.html', '2026-10-18T12:00:01Z']
+
+
+def read_corpus():
+    """
+    :return: the text of the bundled corpus files
+    """
+    text = []
+    for corpus_file in sorted(glob.glob(os.path.join(CORPUS_DIRECTORY, '*.txt'))):
+        with io.open(corpus_file, encoding='utf-8') as f:
+            text.append(f.read())
+    return '\n'.join(text)
+
+
+def make_corpora(text):
+    """
+    Build the benchmark inputs from the corpus text, the same on every run
+    :param text: the corpus text
+    :return: dict of shape name to the list of strings converted one call each
+    """
+    rng = random.Random(SEED)
+    lines = [line for line in text.splitlines() if line]
+    chars = [c for c in text if c not in SEPARATORS and not c.isspace()]
+    cjk = ''.join(chars)
+
+    titles = []
+    for _ in range(2000):
+        start = rng.randrange(len(cjk) - 20)
+        titles.append(cjk[start:start + rng.randint(4, 16)])
+
+    paragraphs = []
+    for _ in range(20):
+        paragraphs.append(''.join(rng.choice(lines) for _ in range(20)).translate(
+            dict.fromkeys(map(ord, SEPARATORS + 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz()'))))
+
+    separated = []
+    for _ in range(200):
+        separated.append(''.join(rng.choice(chars) + rng.choice(SEPARATORS) for _ in range(100)))
+
+    mixed = []
+    for _ in range(1000):
+        words = [rng.choice(ASCII_WORDS) for _ in range(6)]
+        words.insert(rng.randrange(len(words)), cjk[rng.randrange(len(cjk) - 8):][:rng.randint(2, 8)])
+        mixed.append(' '.join(words))
+
+    return {
+        'titles': titles,
+        'paragraphs': paragraphs,
+        'separators': separated,
+        'mixed': mixed,
+    }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def peak_rss_kb():
+    """
+    :return: the peak resident set size of this process in KB, None where unknown
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def measure(conversion, engine, repeat):
+    """
+    Measure one config, in this process
+    :return: dict of results
+    """
+    sys.path.insert(0, ROOT)
+    start = time.perf_counter()
+    from opencc import OpenCC
+    cc = OpenCC(conversion, engine=engine)
+    load = time.perf_counter() - start
+
+    results = {'load_s': load, 'shapes': {}}
+    for shape, texts in sorted(make_corpora(read_corpus()).items()):
+        latencies = []
+        chars = 0
+        for _ in range(repeat):
+            for text in texts:
+                call_start = time.perf_counter()
+                cc.convert(text)
+                latencies.append(time.perf_counter() - call_start)
+                chars += len(text)
+        results['shapes'][shape] = {
+            'calls': len(latencies),
+            'chars_per_s': chars / sum(latencies),
+            'p50_us': percentile(latencies, 0.50) * 1e6,
+            'p99_us': percentile(latencies, 0.99) * 1e6,
+        }
+    results['peak_rss_kb'] = peak_rss_kb()
+    return results
+
+
+def run(conversions, engine, repeat):
+    """
+    Measure each config in its own process
+    :return: the benchmark report
+    """
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'engine': engine,
+        'repeat': repeat,
+        'configs': {},
+    }
+    for conversion in conversions:
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--worker',
+                                          conversion, '--engine', engine, '--repeat', str(repeat)])
+        report['configs'][conversion] = json.loads(output.decode('utf-8'))
+    return report
+
+
+def print_report(report):
+    print('{:8} {:>8} {:>9}  {:10} {:>12} {:>9} {:>9}'.format(
+        'config', 'load ms', 'rss MB', 'shape', 'chars/s', 'p50 us', 'p99 us'))
+    for conversion, result in sorted(report['configs'].items()):
+        rss = result['peak_rss_kb']
+        first = True
+        for shape, stats in sorted(result['shapes'].items()):
+            print('{:8} {:>8} {:>9}  {:10} {:>12.0f} {:>9.1f} {:>9.1f}'.format(
+                conversion if first else '',
+                '{:.1f}'.format(result['load_s'] * 1000) if first else '',
+                '{:.1f}'.format(rss / 1024) if first and rss is not None else '',
+                shape, stats['chars_per_s'], stats['p50_us'], stats['p99_us']))
+            first = False
+
+
+def compare(report, baseline, threshold=THRESHOLD):
+    """
+    Print the metrics that changed by more than threshold against baseline
+    :return: True if no metric got worse by more than threshold
+    """
+    ok = True
+    for conversion, result in sorted(report['configs'].items()):
+        base = baseline['configs'].get(conversion)
+        if base is None:
+            continue
+        metrics = [('load_s', result['load_s'], base['load_s'], False)]
+        if result['peak_rss_kb'] and base['peak_rss_kb']:
+            metrics.append(('peak_rss_kb', result['peak_rss_kb'], base['peak_rss_kb'], False))
+        for shape, stats in sorted(result['shapes'].items()):
+            base_stats = base['shapes'].get(shape)
+            if base_stats is None:
+                continue
+            metrics.append((shape + ' chars_per_s', stats['chars_per_s'], base_stats['chars_per_s'], True))
+            metrics.append((shape + ' p99_us', stats['p99_us'], base_stats['p99_us'], False))
+        for name, value, base_value, higher_is_better in metrics:
+            change = (value - base_value) / base_value if base_value else 0.0
+            worse = -change if higher_is_better else change
+            if abs(change) > threshold:
+                print('{:8} {:24} {:>12.4g} -> {:>12.4g}  {:+.0%}{}'.format(
+                    conversion, name, base_value, value, change, '  REGRESSION' if worse > 0 else ''))
+                if worse > 0:
+                    ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the bundled conversion configs.')
+    parser.add_argument('-c', '--config', metavar='<conversion>', action='append',
+                        help='Config to benchmark, may be repeated (default: all)')
+    parser.add_argument('--engine', default='trie', help='Matching engine (default: trie)')
+    parser.add_argument('--repeat', type=int, default=1, help='Passes over each corpus (default: 1)')
+    parser.add_argument('--output', metavar='<file>', help='Save the results as JSON to <file>')
+    parser.add_argument('--compare', metavar='<file>', help='Compare the results with a JSON baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='Relative change reported by --compare (default: 0.10)')
+    parser.add_argument('--worker', metavar='<conversion>', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(measure(args.worker, args.engine, args.repeat)))
+        return 0
+
+    conversions = args.config or sorted(
+        os.path.splitext(os.path.basename(f))[0] for f in glob.glob(os.path.join(CONFIG_DIRECTORY, '*.json')))
+    report = run(conversions, args.engine, args.repeat)
+    print_report(report)
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(report, indent=2, sort_keys=True))
+    if args.compare:
+        with io.open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print('')
+        return 0 if compare(report, baseline, args.threshold) else 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
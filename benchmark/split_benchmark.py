@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Compare the segmentation of OpenCC.convert: the original 70-branch
+# alternation regex with re.split, against the character class scanner.
+
+import os
+import sys
+import timeit
+import re
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from opencc.opencc import iter_segments
+
+ALTERNATION_RE = re.compile(
+    r'(\s+|-|,|\.|\?|!|\*|　|，|。|、|；|：|？|！|…|“|”|‘|’|『|』|「|」|﹁|﹂|—|－|（|）|《|》|〈|〉|～|．|／|＼|︒|︑|︔|︓|︿|﹀|︹|︺|︙|︐|［|﹇|］|﹈|︕|︖|︰|︳|︴|︽|︾|︵|︶|｛|︷|｝|︸|﹃|﹄|【|︻|】|︼)')
+
+TEXTS = {
+    'separator-dense': '「你好」，他說：「是的！」——（注：見第1.2節）…… ' * 2000,
+    'sentences': '香烟（英语：Cigarette），为烟草制品的一种。鼠标是一种很常见及常用的电脑输入设备。' * 2000,
+    'unpunctuated': '鼠标是一种很常见及常用的电脑输入设备' * 2000,
+}
+
+
+def split_alternation(text):
+    split_string_list = ALTERNATION_RE.split(text)
+    for i in range(0, len(split_string_list)):
+        if i % 2 == 0:
+            segment = split_string_list[i]
+        else:
+            separator = split_string_list[i]
+
+
+def split_class(text):
+    for segment, separator in iter_segments(text):
+        pass
+
+
+def main(number=20):
+    for name, text in sorted(TEXTS.items()):
+        alternation = min(timeit.repeat(lambda: split_alternation(text), number=number, repeat=3))
+        character_class = min(timeit.repeat(lambda: split_class(text), number=number, repeat=3))
+        print('{:16} {:>8} chars  alternation {:8.2f} ms  class {:8.2f} ms  x{:.2f}'.format(
+            name, len(text), alternation * 1000 / number, character_class * 1000 / number,
+            alternation / character_class))
+
+
+if __name__ == '__main__':
+    main()
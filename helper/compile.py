@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import glob
+
+DICT_DIRECTORY = '../opencc/dictionary'
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from opencc.dictionary import compile_dictionary
+
+
+def compile_all(dict_directory=DICT_DIRECTORY):
+    """
+    compile every dictionary file into a binary artifact next to it
+    :param dict_directory: the directory of the dictionary files
+    :return: None
+    """
+    dirname = os.path.dirname(__file__)
+    for input_file in sorted(glob.glob(os.path.join(dirname, dict_directory, '*.txt'))):
+        output_file = compile_dictionary(input_file)
+        print('{} -> {}'.format(os.path.basename(input_file), os.path.basename(output_file)))
+
+
+if __name__ == '__main__':
+    if sys.version_info[0] < 3:
+        print('Require Python3 to run')
+        sys.exit(0)
+    compile_all(*sys.argv[1:])
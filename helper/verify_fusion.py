@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import io
+import glob
+import argparse
+
+CONFIG_DIRECTORY = '../opencc/config'
+CORPUS_DIRECTORY = '../test/corpus'
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from opencc.fusion import verify
+
+
+def read_corpus(corpus_files):
+    """
+    read the lines of the corpus files
+    :param corpus_files: the corpus files
+    :return: list of lines
+    """
+    lines = []
+    for corpus_file in corpus_files:
+        with io.open(corpus_file, encoding='utf-8') as f:
+            lines.extend(line.rstrip('\n') for line in f)
+    return lines
+
+
+def verify_fusion(conversions, corpus_files, show=3):
+    """
+    compare fused and staged conversion of the corpus for each conversion
+    :param conversions: the conversion names
+    :param corpus_files: the corpus files
+    :param show: the number of differing lines printed per conversion
+    :return: True if the fused conversions give the same result on every line
+    """
+    lines = read_corpus(corpus_files)
+    equivalent = True
+    for conversion in conversions:
+        mismatches = verify(conversion, lines)
+        print('{}: {} of {} lines differ'.format(conversion, len(mismatches), len(lines)))
+        for line, expected, result in mismatches[:show]:
+            print('  input:  {}\n  staged: {}\n  fused:  {}'.format(line, expected, result))
+        if mismatches:
+            equivalent = False
+    return equivalent
+
+
+if __name__ == '__main__':
+    if sys.version_info[0] < 3:
+        print('Require Python3 to run')
+        sys.exit(0)
+    dirname = os.path.dirname(__file__)
+    parser = argparse.ArgumentParser(
+        description='Check that fused conversion chains give the same result as the staged ones.')
+    parser.add_argument('conversions', metavar='<conversion>', nargs='*',
+                        help='Conversions to check (default: all configs)')
+    parser.add_argument('--corpus', metavar='<file>', action='append',
+                        help='Corpus file, may be repeated (default: the bundled test corpus)')
+    args = parser.parse_args()
+
+    conversions = args.conversions or sorted(
+        os.path.splitext(os.path.basename(f))[0]
+        for f in glob.glob(os.path.join(dirname, CONFIG_DIRECTORY, '*.json')))
+    corpus_files = args.corpus or sorted(glob.glob(os.path.join(dirname, CORPUS_DIRECTORY, '*.txt')))
+    sys.exit(0 if verify_fusion(conversions, corpus_files) else 1)
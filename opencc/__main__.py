@@ -1,39 +1,132 @@
 from __future__ import print_function
 
 import argparse
+import os
 import sys
 import io
 from opencc import OpenCC
 
+SERVE_ADDRESS = '127.0.0.1:8765'
+
 
 def main():
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('-i', '--input', metavar='<file>',
-                        help='Read original text from <file>.')
+    parser.add_argument('-i', '--input', metavar='<file>', nargs='+',
+                        help='Read original text from <file>. Several files, '
+                             'glob patterns or directories convert each file '
+                             'to the -o directory, or as --in-place/--suffix say')
     parser.add_argument('-o', '--output', metavar='<file>',
                         help='Write converted text to <file>.')
+    parser.add_argument('--in-place', action='store_true',
+                        help='Overwrite the input files with their conversion')
+    parser.add_argument('--suffix', metavar='<suffix>',
+                        help='Write the conversion of a.txt next to it as '
+                             'a<suffix>.txt')
+    parser.add_argument('--include', metavar='<pattern>',
+                        help='Only convert the files of input directories and '
+                             'globs whose name matches <pattern>, e.g. "*.srt"')
+    parser.add_argument('--manifest', metavar='<file>',
+                        help='Record the converted files in <file> and skip '
+                             'those unchanged since the last run')
     parser.add_argument('-c', '--config', metavar='<conversion>',
                         help='Conversion')
     parser.add_argument('--in-enc', metavar='<encoding>', default='UTF-8',
                         help='Encoding for input')
     parser.add_argument('--out-enc', metavar='<encoding>', default='UTF-8',
                         help='Encoding for output')
+    parser.add_argument('-j', '--jobs', metavar='<n>', type=int, default=1,
+                        help='Number of worker processes converting the input')
+    parser.add_argument('--serve', metavar='<address>', nargs='?', const=SERVE_ADDRESS,
+                        help='Serve conversions over HTTP on <host:port> or a '
+                             'Unix socket path (unix:<path> for a bare file '
+                             'name), with every conversion loaded unless -c '
+                             'is given')
+    parser.add_argument('--stdio', action='store_true',
+                        help='Answer line-delimited JSON conversion requests '
+                             'on STDIN/STDOUT')
+    parser.add_argument('--reload', metavar='<seconds>', type=float,
+                        help='With --serve or --stdio, check the dictionary and '
+                             'config files for changes every <seconds> and '
+                             'reload the changed ones')
     args = parser.parse_args()
 
+    if args.serve or args.stdio:
+        return serve(args)
+
     if args.config is None:
         print("Please specify a conversion.", file=sys.stderr)
         return 1
 
     cc = OpenCC(args.config)
 
-    with io.open(args.input if args.input else 0, encoding=args.in_enc) as f:
-        input_str = f.read()
-    output_str = cc.convert(input_str)
-    with io.open(args.output if args.output else 1, 'w',
-              encoding=args.out_enc) as f:
-        f.write(output_str)
+    if _bulk_mode(args):
+        return bulk(cc, args)
+
+    with io.open(args.input[0] if args.input else 0, encoding=args.in_enc) as fin:
+        with io.open(args.output if args.output else 1, 'w',
+                     encoding=args.out_enc) as fout:
+            for output_str in cc.convert_stream(fin, workers=args.jobs):
+                fout.write(output_str)
+
+    return 0
+
+
+def _bulk_mode(args):
+    if args.in_place or args.suffix or args.manifest:
+        return True
+    if not args.input:
+        return False
+    return len(args.input) > 1 or os.path.isdir(args.input[0]) \
+        or any(char in args.input[0] for char in '*?[')
+
+
+def bulk(cc, args):
+    from opencc.bulk import convert_files, summary
 
+    if not args.input:
+        print("Please specify the input files.", file=sys.stderr)
+        return 1
+    if (args.output is not None) + bool(args.in_place) + bool(args.suffix) != 1:
+        print("Please specify one of -o <directory>, --in-place and --suffix.", file=sys.stderr)
+        return 1
+    try:
+        result = convert_files(cc, args.input, args.output, args.in_place, args.suffix, args.include,
+                               args.manifest, args.jobs, args.in_enc, args.out_enc)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    for path, error in result['failed']:
+        print('{}: {}'.format(path, error), file=sys.stderr)
+    print(summary(result), file=sys.stderr)
+    return 1 if result['failed'] else 0
+
+
+def serve(args):
+    from opencc.reload import Reloader
+    from opencc.server import ConversionService, make_server, serve_stdio
+
+    service = ConversionService([args.config] if args.config else None)
+    if args.reload:
+        Reloader(args.reload).start()
+    if args.stdio:
+        with io.open(0, encoding='UTF-8') as fin:
+            with io.open(1, 'w', encoding='UTF-8') as fout:
+                serve_stdio(service, fin, fout)
+        return 0
+
+    try:
+        server = make_server(service, args.serve)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print('Serving {} on {}'.format(', '.join(service.conversions()), args.serve), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
     return 0
 
 
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+##########################################################
+# asyncio front end of OpenCC (Python 3.7+)
+# - Large texts are converted in an executor so the event loop keeps
+#   running, small ones inline where handing them off costs more
+# - The dictionaries are shared with every OpenCC of the same process
+# - At most max_pending conversions are in flight; further calls wait
+##########################################################
+
+import asyncio
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+from .opencc import OpenCC, STREAM_CHUNK_SIZE, STREAM_MAX_BUFFER
+
+# Texts shorter than this are converted on the event loop
+INLINE_SIZE = 1024
+# Most conversions handed to the executor at a time
+MAX_PENDING = 16
+
+# OpenCC of a process executor worker, per (conversion, engine, fuse, lazy,
+# user dictionary files, segmentation)
+_process_opencc = {}
+
+
+def _process_convert(options, string):
+    opencc = _process_opencc.get(options)
+    if opencc is None:
+        opencc = OpenCC(*options[:4], segmentation=options[5])
+        for stage, source in options[4]:
+            opencc.add_user_dictionary(source, stage)
+        _process_opencc[options] = opencc
+    return opencc.convert(string)
+
+
+class AsyncOpenCC(object):
+    def __init__(self, conversion=None, engine='trie', fuse=False, lazy=False, segmentation=False,
+                 executor=None, inline_size=INLINE_SIZE, max_pending=MAX_PENDING):
+        """
+        init AsyncOpenCC
+        :param conversion: the conversion of usage, see OpenCC
+        :param engine: the matching engine, see OpenCC
+        :param fuse: merge the dictionaries of the chain, see OpenCC
+        :param lazy: defer loading large dictionaries, see OpenCC
+        :param segmentation: convert word by word, see OpenCC
+        :param executor: a concurrent.futures executor converting large texts,
+                         None for the default executor of the event loop; each
+                         worker of a ProcessPoolExecutor loads its own dictionaries
+        :param inline_size: texts shorter than this are converted inline
+        :param max_pending: the most conversions in the executor at a time
+        :return: None
+        """
+        self.opencc = OpenCC(conversion, engine, fuse, lazy, segmentation)
+        self.executor = executor
+        self.inline_size = inline_size
+        self.max_pending = max_pending
+        self.in_flight = 0
+        # Created on first use, inside the running event loop
+        self._semaphore = None
+
+    async def convert(self, string):
+        """
+        Convert string, see OpenCC.convert
+        :param string: the input string
+        :return: converted string
+        """
+        if len(string) < self.inline_size:
+            return self.opencc.convert(string)
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                loop = asyncio.get_running_loop()
+                if isinstance(self.executor, ProcessPoolExecutor):
+                    return await loop.run_in_executor(self.executor, _process_convert, self._options(), string)
+                return await loop.run_in_executor(self.executor, self.opencc.convert, string)
+            finally:
+                self.in_flight -= 1
+
+    def _options(self):
+        """
+        :return: what a process executor worker needs to create the same OpenCC
+        """
+        opencc = self.opencc
+        user_dicts = tuple(opencc._user_dicts)
+        if any(not isinstance(source, str) for _, source in user_dicts):
+            # Sending them along with every text would cost more than converting
+            raise ValueError('process executors only support user dictionary files')
+        return opencc.conversion, opencc.engine, opencc.fuse, opencc.lazy, user_dicts, opencc.segmentation
+
+    async def convert_stream(self, stream, chunk_size=STREAM_CHUNK_SIZE, max_buffer=STREAM_MAX_BUFFER):
+        """
+        Convert a stream of text piece by piece, see OpenCC.convert_stream.
+        Up to max_pending pieces are converted ahead of the consumer.
+        :param stream: an async iterable of strings, a file object opened in text
+                       mode or an iterable of strings
+        :param chunk_size: the number of characters read at a time from a file object
+        :param max_buffer: the most characters held back waiting for a separator
+        :return: async generator of converted strings, in order
+        """
+        pending = collections.deque()
+        try:
+            async for piece in self._stream_pieces(stream, chunk_size, max_buffer):
+                pending.append(asyncio.ensure_future(self.convert(piece)))
+                if len(pending) >= self.max_pending:
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def _stream_pieces(self, stream, chunk_size, max_buffer):
+        """
+        Cut a stream of text right after separators
+        :return: async generator of strings
+        """
+        if not hasattr(stream, '__aiter__'):
+            for piece in self.opencc._stream_pieces(stream, chunk_size, max_buffer):
+                yield piece
+            return
+
+        buffer = ''
+        async for chunk in stream:
+            pieces, buffer = self.opencc._stream_feed(buffer, chunk, max_buffer)
+            for piece in pieces:
+                yield piece
+        if buffer:
+            yield buffer
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+##########################################################
+# Bulk conversion of files and directory trees
+# - The dictionaries are loaded once for all the files; the files are read
+#   and written by a pool of I/O threads, a window ahead of and behind the
+#   conversion, which runs in this process or in a pool of worker processes
+# - A manifest records the size, mtime and content hash of every converted
+#   file, so a run skips the files unchanged since the last one
+##########################################################
+
+import fnmatch
+import glob
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+
+from .opencc import _worker_convert
+
+# Files read, converted and written at a time
+BULK_WINDOW = 256
+# Threads reading and writing files
+BULK_IO_THREADS = 4
+
+_GLOB_CHARS = '*?['
+
+try:
+    _replace = os.replace
+except AttributeError:  # pragma: no cover
+    # Python 2, where rename replaces an existing file on POSIX
+    _replace = os.rename
+
+
+def collect_files(inputs, include=None, exclude_dir=None, exclude_suffix=None):
+    """
+    Expand files, glob patterns and directories, walked recursively, into the
+    files to convert
+    :param inputs: list of file paths, glob patterns ('**' matches any number
+                   of directories) and directory paths
+    :param include: fnmatch pattern of the file names taken from directories
+                    and glob patterns, e.g. '*.srt', None for every file
+    :param exclude_dir: a directory left out of the walks, e.g. the output one
+    :param exclude_suffix: file names whose root ends with it are left out of
+                           the walks, e.g. the outputs of an earlier run
+    :return: list of (file path, path relative to the input it came from), in
+             order, without duplicates
+    """
+    if exclude_dir is not None:
+        exclude_dir = os.path.abspath(exclude_dir)
+
+    def wanted(path):
+        name = os.path.basename(path)
+        if include is not None and not fnmatch.fnmatch(name, include):
+            return False
+        if exclude_suffix and os.path.splitext(name)[0].endswith(exclude_suffix):
+            return False
+        return exclude_dir is None or not os.path.abspath(path).startswith(exclude_dir + os.sep)
+
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, names in os.walk(item):
+                dirs[:] = sorted(name for name in dirs
+                                 if os.path.abspath(os.path.join(root, name)) != exclude_dir)
+                for name in sorted(names):
+                    path = os.path.join(root, name)
+                    if wanted(path):
+                        files.append((path, os.path.relpath(path, item)))
+        elif any(char in item for char in _GLOB_CHARS):
+            base = _glob_base(item)
+            for path in sorted(_glob(item)):
+                if os.path.isfile(path) and wanted(path):
+                    files.append((path, os.path.relpath(path, base)))
+        else:
+            files.append((item, os.path.basename(item)))
+
+    seen = set()
+    unique = []
+    for path, relative in files:
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            unique.append((path, relative))
+    return unique
+
+
+def _glob(pattern):
+    try:
+        return glob.glob(pattern, recursive=True)
+    except TypeError:  # pragma: no cover
+        # Python 2 has no recursive '**'
+        return glob.glob(pattern)
+
+
+def _glob_base(pattern):
+    """
+    :return: the leading directories of a glob pattern without glob characters
+    """
+    parts = []
+    for part in pattern.split(os.sep):
+        if any(char in part for char in _GLOB_CHARS):
+            break
+        parts.append(part)
+    return os.sep.join(parts) or os.curdir
+
+
+def output_path(path, relative, output_dir=None, in_place=False, suffix=None):
+    """
+    :param path: the file converted
+    :param relative: its path relative to the input it came from
+    :param output_dir: write the output tree under this directory
+    :param in_place: overwrite the file
+    :param suffix: write next to the file, the suffix inserted before the
+                   extension: a.srt becomes a<suffix>.srt
+    :return: the path the conversion of the file is written to
+    """
+    if in_place:
+        return path
+    if suffix:
+        root, ext = os.path.splitext(path)
+        return root + suffix + ext
+    return os.path.join(output_dir, relative)
+
+
+def load_manifest(path):
+    """
+    :param path: the manifest file
+    :return: dict of source file to its entry, empty when there is no manifest
+    """
+    if path is None or not os.path.exists(path):
+        return {}
+    with io.open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    """
+    Write a manifest, through a temporary file so an interrupted run leaves
+    the previous one
+    :param path: the manifest file
+    :param manifest: dict of source file to its entry
+    :return: None
+    """
+    temp = path + '.tmp'
+    with io.open(temp, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(manifest, ensure_ascii=False, indent=1, sort_keys=True))
+    _replace(temp, path)
+
+
+class _Job(object):
+    __slots__ = ('source', 'output', 'key', 'text', 'digest', 'error', 'skipped', 'size')
+
+    def __init__(self, source, output):
+        self.source = source
+        self.output = output
+        self.key = os.path.abspath(source)
+        self.text = None
+        self.digest = None
+        self.error = None
+        self.skipped = False
+        self.size = 0
+
+
+def convert_files(opencc, inputs, output_dir=None, in_place=False, suffix=None, include=None,
+                  manifest=None, workers=1, in_enc='UTF-8', out_enc='UTF-8', window=BULK_WINDOW,
+                  io_threads=BULK_IO_THREADS):
+    """
+    Convert many files with one converter. Line endings are kept. A file
+    that fails to be read, decoded or written is reported and skipped.
+    :param opencc: the OpenCC converting the files
+    :param inputs: list of files, glob patterns and directories, see collect_files
+    :param output_dir: write the converted tree under this directory
+    :param in_place: overwrite the files with their conversion
+    :param suffix: write each conversion next to its file, see output_path
+    :param include: fnmatch pattern of the file names taken from directories
+                    and glob patterns
+    :param manifest: the manifest file; files unchanged since the run that
+                     wrote it, and whose output is still there, are skipped
+    :param workers: the number of worker processes converting, None for one
+                    per CPU, 1 converts in this process
+    :param in_enc: the encoding of the files
+    :param out_enc: the encoding of the outputs
+    :param window: the number of files read, converted and written at a time
+    :param io_threads: the number of threads reading and writing files
+    :return: dict of the run: 'files' converted, 'skipped', 'failed' as a
+             list of (file, error message), 'chars', 'bytes' read, 'seconds'
+    """
+    if sum([output_dir is not None, bool(in_place), bool(suffix)]) != 1:
+        raise ValueError('give exactly one of output_dir, in_place and suffix')
+    if output_dir is not None:
+        # The walks leave the output directory out, so nothing in it is converted
+        top = os.path.abspath(output_dir) + os.sep
+        for item in inputs:
+            base = _glob_base(item) if any(char in item for char in _GLOB_CHARS) else item
+            if os.path.isdir(base) and (os.path.abspath(base) + os.sep).startswith(top):
+                raise ValueError('input {} is in the output directory {}'.format(item, output_dir))
+    start = time.time()
+    files = collect_files(inputs, include, output_dir, suffix)
+    if manifest is not None:
+        files = [item for item in files if os.path.abspath(item[0]) != os.path.abspath(manifest)]
+    outputs = {}
+    for path, relative in files:
+        output = os.path.abspath(output_path(path, relative, output_dir, in_place, suffix))
+        if output in outputs:
+            raise ValueError('{} and {} would both be written to {}'.format(outputs[output], path, output))
+        outputs[output] = path
+    # The mode of new outputs, as open() would create them
+    umask = os.umask(0)
+    os.umask(umask)
+    entries = load_manifest(manifest)
+    conversion = opencc.conversion
+    jobs = []
+    skipped = 0
+    for path, relative in files:
+        job = _Job(path, output_path(path, relative, output_dir, in_place, suffix))
+        entry = entries.get(job.key)
+        if entry is not None and (entry.get('conversion') != conversion or entry.get('output') != job.output
+                                  or not os.path.exists(job.output)):
+            entry = None
+        if entry is not None:
+            stat = os.stat(path)
+            if (stat.st_size, stat.st_mtime) == (entry['size'], entry['mtime']):
+                skipped += 1
+                continue
+        jobs.append((job, entry))
+
+    def read(item):
+        job, entry = item
+        try:
+            with open(job.source, 'rb') as f:
+                data = f.read()
+            job.size = len(data)
+            job.digest = hashlib.sha1(data).hexdigest()
+            if entry is not None and entry['sha1'] == job.digest:
+                # Only touched
+                job.skipped = True
+            else:
+                job.text = data.decode(in_enc)
+        except (IOError, OSError, UnicodeDecodeError) as e:
+            job.error = e
+        return job
+
+    def write(job):
+        try:
+            directory = os.path.dirname(job.output)
+            if directory and not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    # Made by another thread meanwhile
+                    if not os.path.isdir(directory):
+                        raise
+            data = job.text.encode(out_enc)
+            handle, temp = tempfile.mkstemp(dir=directory or os.curdir, prefix='.opencc-', suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'wb') as f:
+                    f.write(data)
+                if os.path.exists(job.output):
+                    # Keep the permissions of the file replaced
+                    shutil.copymode(job.output, temp)
+                else:
+                    os.chmod(temp, 0o666 & ~umask)
+                _replace(temp, job.output)
+            except BaseException:
+                os.remove(temp)
+                raise
+            if in_place:
+                # The next run sees the converted file as the source
+                job.digest = hashlib.sha1(data).hexdigest()
+        except (IOError, OSError, UnicodeEncodeError) as e:
+            job.error = e
+        job.text = None
+        return job
+
+    result = {'files': 0, 'skipped': skipped, 'failed': [], 'chars': 0, 'bytes': 0}
+
+    def record(job):
+        if job.error is not None:
+            result['failed'].append((job.source, str(job.error)))
+            return
+        stat = os.stat(job.source)
+        entries[job.key] = {'conversion': conversion, 'output': job.output, 'size': stat.st_size,
+                            'mtime': stat.st_mtime, 'sha1': job.digest}
+        if job.skipped:
+            result['skipped'] += 1
+        else:
+            result['files'] += 1
+            result['bytes'] += job.size
+
+    io_pool = ThreadPool(io_threads)
+    pool = opencc._create_pool(workers) if workers != 1 else None
+    try:
+        windows = [jobs[i:i + window] for i in range(0, len(jobs), window)]
+        reading = io_pool.map_async(read, windows[0]) if windows else None
+        writing = None
+        for index in range(len(windows)):
+            batch = reading.get()
+            # Read the next window and write the previous one while converting
+            if index + 1 < len(windows):
+                reading = io_pool.map_async(read, windows[index + 1])
+            todo = [job for job in batch if job.text is not None]
+            texts = [job.text for job in todo]
+            if pool is not None:
+                converted = pool.map(_worker_convert, texts, 1)
+            else:
+                converted = [opencc.convert(text) for text in texts]
+            for job, text in zip(todo, converted):
+                result['chars'] += len(job.text)
+                job.text = text
+            if writing is not None:
+                for job in writing.get():
+                    record(job)
+            for job in batch:
+                if job.text is None:
+                    record(job)
+            writing = io_pool.map_async(write, todo)
+        if writing is not None:
+            for job in writing.get():
+                record(job)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        io_pool.close()
+        io_pool.join()
+        if manifest is not None:
+            save_manifest(manifest, entries)
+    result['seconds'] = time.time() - start
+    return result
+
+
+def summary(result):
+    """
+    :param result: the result of convert_files
+    :return: a line of text reporting the run and its throughput
+    """
+    seconds = result['seconds'] or 1e-9
+    line = 'Converted {} files, {} chars ({:.1f} MB) in {:.2f} s: {:.0f} files/s, {:.2f} MB/s; ' \
+           '{} unchanged, {} failed'.format(result['files'], result['chars'], result['bytes'] / 1e6, seconds,
+                                          result['files'] / seconds, result['bytes'] / 1e6 / seconds,
+                                          result['skipped'], len(result['failed']))
+    return line
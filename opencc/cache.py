@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+##########################################################
+# Bounded LRU memo of converted segments
+##########################################################
+
+import sys
+import threading
+from collections import OrderedDict
+
+
+class SegmentCache(object):
+    def __init__(self, max_entries=10000, max_bytes=None):
+        """
+        init SegmentCache
+        :param max_entries: the most segments kept, None for no limit
+        :param max_bytes: the most memory used by the kept strings, None for no limit
+        :return: None
+        """
+        if max_entries is None and max_bytes is None:
+            raise ValueError('the cache needs max_entries or max_bytes')
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, segment):
+        """
+        :param segment: the segment to convert
+        :return: the cached conversion of segment or None
+        """
+        with self._lock:
+            entry = self._entries.get(segment)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Mark as most recently used
+            del self._entries[segment]
+            self._entries[segment] = entry
+            return entry[0]
+
+    def put(self, segment, converted):
+        """
+        :param segment: the segment
+        :param converted: its conversion
+        :return: None
+        """
+        size = sys.getsizeof(segment) + sys.getsizeof(converted)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(segment, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[segment] = (converted, size)
+            self._bytes += size
+            while (self.max_entries is not None and len(self._entries) > self.max_entries) \
+                    or (self.max_bytes is not None and self._bytes > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Drop every entry, the counters are kept
+        :return: None
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def renew(self):
+        """
+        Get an empty cache with the same limits, taking over the counters; the
+        writers still holding this one no longer reach the new one
+        :return: SegmentCache
+        """
+        cache = SegmentCache(self.max_entries, self.max_bytes)
+        with self._lock:
+            cache.hits = self.hits
+            cache.misses = self.misses
+            cache.evictions = self.evictions
+        return cache
+
+    def stats(self):
+        """
+        :return: dict of 'hits', 'misses', 'evictions', 'entries' and 'bytes'
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
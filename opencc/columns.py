@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+##########################################################
+# Conversion of many short strings and of data frame columns
+# - Duplicates are converted once: the values are cut into their distinct
+#   values and the codes pointing at them, the distinct values converted,
+#   then taken back in place by code
+# - The distinct values are joined with a character no dictionary key
+#   contains and converted a chunk at a time, so the cost of a convert()
+#   call is paid per chunk rather than per string
+# - pandas, NumPy and pyarrow columns are cut and taken back by their own
+#   vectorized functions; none of them is required
+##########################################################
+
+from .markup import _SENTINELS
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+# Characters of distinct strings joined into one convert() call
+MANY_CHUNK_SIZE = 64 * 1024
+
+
+def factorize(values):
+    """
+    :param values: iterable of hashable values
+    :return: list of the distinct values in order of first occurrence, list
+             of the index in it of every value
+    """
+    index = {}
+    codes = []
+    for value in values:
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(index)
+        codes.append(code)
+    return list(index), codes
+
+
+def convert_unique(opencc, values, workers=1, chunk_size=MANY_CHUNK_SIZE):
+    """
+    Convert a list of strings, joined into a few large convert() calls
+    :param opencc: the OpenCC converting the strings
+    :param values: list of values; those that are not strings, such as None,
+                   are returned as they are
+    :param workers: the number of worker processes, None for one per CPU, 1
+                    converts in this process
+    :param chunk_size: the number of characters converted per call
+    :return: list of the converted values
+    """
+    texts = [value for value in values if isinstance(value, text_type)]
+    sentinel = None
+    if texts:
+        joined = "".join(texts)
+        for char in _SENTINELS:
+            if char not in joined:
+                sentinel = char
+                break
+
+    if sentinel is None:
+        chunks = texts
+    else:
+        chunks = []
+        chunk = []
+        size = 0
+        for text in texts:
+            chunk.append(text)
+            size += len(text) + 1
+            if size >= chunk_size:
+                chunks.append(sentinel.join(chunk))
+                chunk = []
+                size = 0
+        if chunk:
+            chunks.append(sentinel.join(chunk))
+
+    if workers == 1:
+        converted = [opencc.convert(chunk) for chunk in chunks]
+    else:
+        converted = opencc.convert_batch(chunks, workers, 1)
+    if sentinel is not None:
+        converted = [text for chunk in converted for text in chunk.split(sentinel)]
+
+    converted = iter(converted)
+    return [next(converted) if isinstance(value, text_type) else value for value in values]
+
+
+def convert_many(opencc, values, workers=1):
+    """
+    Convert many strings, each distinct one once
+    :param opencc: the OpenCC converting the strings
+    :param values: iterable of strings; other values such as None are
+                   returned as they are
+    :param workers: see convert_unique
+    :return: list of the converted values, in the order of values
+    """
+    uniques, codes = factorize(values)
+    converted = convert_unique(opencc, uniques, workers)
+    return [converted[code] for code in codes]
+
+
+def convert_series(opencc, values, workers=1):
+    """
+    Convert a column of strings. Missing and non-string values are kept.
+    :param opencc: the OpenCC converting the strings
+    :param values: a pandas Series, Index or array, a NumPy array, a pyarrow
+                   Array or ChunkedArray, or any other iterable
+    :param workers: see convert_unique
+    :return: the converted column, of the same kind, shape, index and dtype
+             as values; a list for other iterables
+    """
+    module = type(values).__module__.split('.')[0]
+    if module == 'pandas':
+        return _convert_pandas(opencc, values, workers)
+    if module == 'numpy':
+        return _convert_numpy(opencc, values, workers)
+    if module == 'pyarrow':
+        return _convert_arrow(opencc, values, workers, {})
+    return convert_many(opencc, values, workers)
+
+
+def _take(opencc, values, codes, uniques, workers):
+    """
+    :param values: the 1-D object array the codes were computed from
+    :param codes: NumPy array of the codes of values, -1 for missing values
+    :param uniques: list of the distinct values
+    :return: object array of the converted values, the missing ones kept
+    """
+    import numpy
+    converted = numpy.empty(len(uniques) + 1, dtype=object)
+    converted[:-1] = convert_unique(opencc, uniques, workers)
+    result = converted.take(codes)
+    missing = codes < 0
+    if missing.any():
+        result[missing] = values[missing]
+    return result
+
+
+def _convert_pandas(opencc, values, workers):
+    import numpy
+    import pandas
+    codes, uniques = pandas.factorize(values)
+    result = _take(opencc, numpy.asarray(values, dtype=object), codes, list(uniques), workers)
+    dtype = values.dtype
+    if isinstance(dtype, pandas.CategoricalDtype):
+        # Two categories may convert to the same string
+        dtype = 'category'
+    elif not isinstance(dtype, pandas.StringDtype):
+        dtype = object
+    if isinstance(values, pandas.Series):
+        return pandas.Series(result, index=values.index, name=values.name, dtype=dtype)
+    if isinstance(values, pandas.Index):
+        return pandas.Index(result, name=values.name, dtype=dtype)
+    return pandas.array(result, dtype=dtype)
+
+
+def _convert_numpy(opencc, values, workers):
+    import numpy
+    flat = values.ravel()
+    if values.dtype.kind == 'U':
+        # Sorted dedup, no Python object per element
+        uniques, codes = numpy.unique(flat, return_inverse=True)
+        converted = convert_unique(opencc, uniques.tolist(), workers)
+        if not converted:
+            return values.copy()
+        return numpy.array(converted).take(codes.ravel()).reshape(values.shape)
+    try:
+        import pandas
+    except ImportError:
+        uniques, codes = factorize(flat.tolist())
+        codes = numpy.array(codes, dtype=numpy.intp)
+    else:
+        codes, uniques = pandas.factorize(flat)
+        uniques = list(uniques)
+    return _take(opencc, flat.astype(object), codes, uniques, workers).reshape(values.shape)
+
+
+def _convert_arrow(opencc, values, workers, memo):
+    """
+    :param memo: dict of the strings already converted to their conversion,
+                 shared by the chunks of a ChunkedArray
+    """
+    import pyarrow
+    if isinstance(values, pyarrow.ChunkedArray):
+        return pyarrow.chunked_array([_convert_arrow(opencc, chunk, workers, memo) for chunk in values.chunks],
+                                     type=values.type)
+    if pyarrow.types.is_dictionary(values.type):
+        # Already encoded, convert the dictionary; it may hold duplicates
+        return pyarrow.DictionaryArray.from_arrays(values.indices,
+                                                   _convert_arrow(opencc, values.dictionary, workers, memo))
+    encoded = values.dictionary_encode()
+    uniques = encoded.dictionary.to_pylist()
+    todo = [value for value in uniques if value not in memo]
+    memo.update(zip(todo, convert_unique(opencc, todo, workers)))
+    converted = pyarrow.array([memo[value] for value in uniques], type=values.type)
+    # Null indices take nulls
+    return converted.take(encoded.indices)
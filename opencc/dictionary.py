@@ -0,0 +1,596 @@
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+##########################################################
+# Process-wide dictionary registry
+# - A dictionary file is parsed once per process and shared, read-only, by
+#   every OpenCC instance and conversion using it
+# - Entries are keyed by file path and checked against the file mtime, a
+#   changed file is parsed again on next use
+# - reload() parses changed files again ahead of use, e.g. from a background
+#   thread, and swaps the new entries in; see reload.py
+# - A dictionary can be compiled into a binary artifact next to its .txt
+#   file, which is read with one call and decoded in bulk instead of being
+#   parsed line by line
+# - With the packed storage, the mappings are kept as PackedMap rather than
+#   dict, so processes forked after loading keep sharing them; see packed.py
+##########################################################
+
+import gc
+import hashlib
+import io
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+try:
+    from types import MappingProxyType
+except ImportError:  # pragma: no cover
+    # Python 2 has no read-only dict view
+    MappingProxyType = dict
+
+from .packed import PackedMap
+from .trie import DictTrie, key_prefixes
+
+
+class Dictionary(namedtuple('Dictionary', ['max_len', 'min_len', 'map_dict', 'candidates'])):
+    """
+    A parsed dictionary file: max key length, min key length, a read-only
+    mapping of keys to their primary value and a read-only mapping of the
+    keys with several values to the tuple of all of them, primary first
+    """
+    __slots__ = ()
+
+
+class _Entry(object):
+    __slots__ = ('mtime', 'digest', 'map_dict', 'candidates', 'prefixes', 'dictionary', 'trie', 'timings')
+
+    def __init__(self, mtime, max_len, min_len, map_dict, candidates, prefixes=None):
+        self.mtime = mtime
+        # Content hash of the file, computed on the first changed_paths(check='hash')
+        self.digest = None
+        self.map_dict = map_dict
+        self.candidates = candidates
+        self.prefixes = prefixes
+        self.dictionary = Dictionary(max_len, min_len, MappingProxyType(map_dict),
+                                     MappingProxyType(candidates))
+        self.trie = None
+        self.timings = {}
+
+
+class UserDictionary(object):
+    """
+    A user dictionary given as a dict rather than a file, normalized once
+    into the form of a parsed dictionary file
+    """
+    __slots__ = ('max_len', 'min_len', 'map_dict', 'candidates')
+
+    def __init__(self, mapping):
+        """
+        init UserDictionary
+        :param mapping: dict of keys to a value, several values separated by
+                        spaces, or a list of values, the primary one first
+        :return: None
+        """
+        self.map_dict = {}
+        self.candidates = {}
+        for key, value in mapping.items():
+            values = tuple(value.split(' ') if isinstance(value, type('')) else value)
+            if not key or not values:
+                raise ValueError('empty key or value in user dictionary: {!r}'.format(key))
+            self.map_dict[key] = values[0]
+            if len(values) > 1:
+                self.candidates[key] = values
+        self.max_len = max([len(key) for key in self.map_dict] or [1])
+        self.min_len = min([len(key) for key in self.map_dict] or [1000])
+
+
+STORAGE_DICT = 'dict'
+STORAGE_PACKED = 'packed'
+STORAGES = (STORAGE_DICT, STORAGE_PACKED)
+
+_registry = {}
+_lock = threading.RLock()
+_storage = STORAGE_DICT
+# key built from the sources: (Dictionary, DictTrie) of the merged overlay
+_overlays = {}
+# path: (mtime, first characters of the keys, seconds spent reading them)
+_first_chars = {}
+
+# Binary artifact layout, all little-endian:
+#   header   magic, version, entry count, max key length, min key length,
+#            source size, source mtime (microseconds), key blob size,
+#            value blob size, prefix blob size, candidate blob size
+#   index    (count + 1) uint32 key offsets, (count + 1) uint32 value offsets
+#   blobs    UTF-8 keys in code point order, their primary values, the proper
+#            key prefixes used by the prefix index, then the keys with several
+#            values as 'key\tvalue value...'; each entry terminated by '\n'
+BINARY_EXT = '.ocb'
+BINARY_MAGIC = b'OCCB'
+BINARY_VERSION = 2
+_HEADER = struct.Struct(str('<4sIIIIqqIIII'))
+_OFFSET = struct.Struct(str('<I'))
+
+
+def parse_dictionary(path):
+    """
+    Read a tab separated dictionary file. Space separated values are split
+    once here, so matching never has to.
+    :param path: the dictionary file
+    :return: max key length, min key length, dict of keys to their primary
+             value, dict of the keys with several values to all of them
+    """
+    map_dict = {}
+    candidates = {}
+    # Default max key length to smallest possible value
+    max_len = 1
+    # Default min key length to very large value
+    min_len = 1000
+    with io.open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            key, value = line.strip().split('\t')
+            if ' ' in value:
+                candidates[key] = tuple(value.split(' '))
+                value = candidates[key][0]
+            map_dict[key] = value
+            if len(key) > max_len:
+                max_len = len(key)
+            if len(key) < min_len:
+                min_len = len(key)
+    return max_len, min_len, map_dict, candidates
+
+
+def binary_path(path):
+    """
+    :param path: the dictionary .txt file
+    :return: the path of its compiled binary artifact
+    """
+    return os.path.splitext(path)[0] + BINARY_EXT
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return stat.st_size, int(round(stat.st_mtime * 1000000))
+
+
+def compile_dictionary(path, output=None):
+    """
+    Compile a dictionary .txt file into a binary artifact
+    :param path: the dictionary file
+    :param output: the artifact file, defaults to binary_path(path)
+    :return: the artifact file
+    """
+    if output is None:
+        output = binary_path(path)
+    max_len, min_len, map_dict, candidates = parse_dictionary(path)
+    keys = sorted(map_dict)
+    key_blob = "".join(key + '\n' for key in keys).encode('utf-8')
+    value_blob = "".join(map_dict[key] + '\n' for key in keys).encode('utf-8')
+    prefix_blob = "".join(prefix + '\n' for prefix in sorted(key_prefixes(keys))).encode('utf-8')
+    candidate_blob = "".join(key + '\t' + ' '.join(candidates[key]) + '\n'
+                             for key in sorted(candidates)).encode('utf-8')
+    size, mtime = _source_stamp(path)
+
+    offsets = []
+    for blob in (key_blob, value_blob):
+        pos = 0
+        offsets.append(pos)
+        for _ in keys:
+            pos = blob.index(b'\n', pos) + 1
+            offsets.append(pos)
+
+    # Write to a temporary file first so readers never map a partial artifact
+    temp = output + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(keys), max_len, min_len,
+                             size, mtime, len(key_blob), len(value_blob), len(prefix_blob),
+                             len(candidate_blob)))
+        f.write(struct.pack(str('<{}I'.format(len(offsets))), *offsets))
+        f.write(key_blob)
+        f.write(value_blob)
+        f.write(prefix_blob)
+        f.write(candidate_blob)
+    if os.path.exists(output):
+        os.remove(output)
+    os.rename(temp, output)
+    return output
+
+
+def load_compiled(path, source=None):
+    """
+    Load a binary dictionary artifact
+    :param path: the artifact file
+    :param source: the dictionary .txt file it was compiled from, if given the
+                   artifact is only used when it matches the file size and mtime
+    :return: max key length, min key length, dict of keys to their primary
+             value, dict of the keys with several values to all of them, list
+             of key prefixes or None if the artifact is missing, stale or invalid
+    """
+    if not os.path.exists(path):
+        return None
+    # The whole artifact is decoded into Python objects, a mapping of the
+    # file would not outlive this call
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < _HEADER.size:
+        return None
+    (magic, version, count, max_len, min_len, size, mtime,
+     key_size, value_size, prefix_size, candidate_size) = _HEADER.unpack_from(data, 0)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        return None
+    if source is not None and (size, mtime) != _source_stamp(source):
+        return None
+    start = _HEADER.size + _OFFSET.size * 2 * (count + 1)
+    if start + key_size + value_size + prefix_size + candidate_size != len(data):
+        return None
+    # Decode each blob with one call; every entry ends with '\n' so the
+    # split leaves a trailing empty string
+    keys = data[start:start + key_size].decode('utf-8').split('\n')
+    start += key_size
+    values = data[start:start + value_size].decode('utf-8').split('\n')
+    start += value_size
+    prefixes = data[start:start + prefix_size].decode('utf-8').split('\n')
+    start += prefix_size
+    candidate_lines = data[start:start + candidate_size].decode('utf-8').split('\n')
+    keys.pop()
+    values.pop()
+    prefixes.pop()
+    candidate_lines.pop()
+    candidates = {}
+    for line in candidate_lines:
+        key, value = line.split('\t')
+        candidates[key] = tuple(value.split(' '))
+    return max_len, min_len, dict(zip(keys, values)), candidates, prefixes
+
+
+def load_dictionary(path):
+    """
+    Load a dictionary file, from its binary artifact when that is up to date
+    :param path: the dictionary .txt file
+    :return: max key length, min key length, dict of keys to their primary
+             value, dict of the keys with several values to all of them, list
+             of key prefixes or None when loaded from the .txt file
+    """
+    if path.endswith(BINARY_EXT):
+        loaded = load_compiled(path)
+        if loaded is None:
+            raise ValueError('invalid dictionary artifact: {}'.format(path))
+        return loaded
+    source = path if os.path.exists(path) else None
+    loaded = load_compiled(binary_path(path), source)
+    if loaded is None:
+        loaded = parse_dictionary(path) + (None,)
+    return loaded
+
+
+def _mtime(path):
+    # A dictionary shipped only as a binary artifact is keyed by the artifact
+    if not os.path.exists(path) and os.path.exists(binary_path(path)):
+        path = binary_path(path)
+    return os.path.getmtime(path)
+
+
+def _digest(path):
+    if not os.path.exists(path) and os.path.exists(binary_path(path)):
+        path = binary_path(path)
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def set_storage(storage):
+    """
+    Set how the dictionaries loaded from then on keep their mappings. Those
+    already loaded keep theirs until they are reloaded or evicted.
+    :param storage: 'dict' for dicts, the fastest to match against; 'packed'
+                    for PackedMap, which stay shared with processes forked
+                    after loading, at the cost of slower matching
+    :return: None
+    """
+    global _storage
+    if storage not in STORAGES:
+        raise ValueError('unknown storage: {}'.format(storage))
+    _storage = storage
+
+
+def get_storage():
+    """
+    :return: the storage set by set_storage
+    """
+    return _storage
+
+
+def pack(map_dict):
+    """
+    :param map_dict: dict of keys to values
+    :return: map_dict in the storage set by set_storage
+    """
+    if _storage == STORAGE_PACKED and not isinstance(map_dict, PackedMap):
+        return PackedMap.from_dict(map_dict)
+    return map_dict
+
+
+def prepare_fork():
+    """
+    Call in a process about to fork workers, e.g. a preforking server master,
+    once the dictionaries are loaded. Garbage is collected, then every object
+    left is moved out of reach of the garbage collector (gc.freeze, Python
+    3.7+), whose passes in the workers would otherwise write to them.
+    :return: None
+    """
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+
+def _load_entry(path, mtime, index=False):
+    start = time.time()
+    max_len, min_len, map_dict, candidates, prefixes = load_dictionary(path)
+    entry = _Entry(mtime, max_len, min_len, pack(map_dict), candidates, prefixes)
+    entry.timings['load'] = time.time() - start
+    if index:
+        _build_trie(entry, path)
+    return entry
+
+
+def _build_trie(entry, path):
+    start = time.time()
+    dictionary = entry.dictionary
+    entry.trie = DictTrie(dictionary.max_len, dictionary.min_len, entry.map_dict,
+                          entry.prefixes, os.path.basename(path), entry.candidates)
+    # The prefix list is no longer needed once the index is built
+    entry.prefixes = None
+    entry.timings['index'] = time.time() - start
+
+
+def _get_entry(path):
+    mtime = _mtime(path)
+    entry = _registry.get(path)
+    if entry is not None and entry.mtime == mtime:
+        return entry
+    with _lock:
+        entry = _registry.get(path)
+        if entry is None or entry.mtime != mtime:
+            entry = _load_entry(path, mtime)
+            _registry[path] = entry
+        return entry
+
+
+def get_dictionary(path):
+    """
+    Get the shared parsed dictionary of a file, parsing it if needed
+    :param path: the dictionary file
+    :return: Dictionary
+    """
+    return _get_entry(path).dictionary
+
+
+def get_trie(path):
+    """
+    Get the shared prefix index of a dictionary file, building it if needed
+    :param path: the dictionary file
+    :return: DictTrie
+    """
+    entry = _get_entry(path)
+    if entry.trie is None:
+        with _lock:
+            if entry.trie is None:
+                _build_trie(entry, path)
+    return entry.trie
+
+
+def get_overlay(path, sources, cache=None):
+    """
+    Get a dictionary file merged with user dictionaries, merging them on first
+    use. The user dictionaries take precedence for a key, a later one over an
+    earlier one.
+    :param path: the dictionary file
+    :param sources: list of dictionary files (.txt, or .ocb artifacts) and
+                    UserDictionary
+    :param cache: the dict keeping the merged dictionaries, None for the
+                  registry; a UserDictionary in the key is kept alive by it
+    :return: Dictionary, DictTrie
+    """
+    if cache is None:
+        cache = _overlays
+    cache_key = ((path, _mtime(path)),) + tuple(
+        source if isinstance(source, UserDictionary) else (source, _mtime(source)) for source in sources)
+    overlay = cache.get(cache_key)
+    if overlay is not None:
+        return overlay
+    with _lock:
+        overlay = cache.get(cache_key)
+        if overlay is not None:
+            return overlay
+        base = get_dictionary(path)
+        max_len = base.max_len
+        min_len = base.min_len
+        map_dict = dict(base.map_dict)
+        candidates = dict(base.candidates)
+        keys = []
+        for source in sources:
+            if not isinstance(source, UserDictionary):
+                source = get_dictionary(source)
+            max_len = max(max_len, source.max_len)
+            min_len = min(min_len, source.min_len)
+            for key in source.map_dict:
+                candidates.pop(key, None)
+            map_dict.update(source.map_dict)
+            candidates.update(source.candidates)
+            keys.extend(source.map_dict)
+        # Only the prefixes of the user keys are new
+        prefixes = get_trie(path).prefixes.union(key_prefixes(keys))
+        map_dict = pack(map_dict)
+        overlay = (Dictionary(max_len, min_len, MappingProxyType(map_dict), MappingProxyType(candidates)),
+                   DictTrie(max_len, min_len, map_dict, prefixes, os.path.basename(path) + '+user', candidates))
+        cache[cache_key] = overlay
+        return overlay
+
+
+def is_loaded(path):
+    """
+    :param path: the dictionary file
+    :return: True if the registry holds an up to date copy of the file
+    """
+    entry = _registry.get(path)
+    return entry is not None and entry.mtime == _mtime(path)
+
+
+def get_first_chars(path):
+    """
+    Get the set of characters the keys of a dictionary start with, without
+    loading the whole dictionary when it is not loaded yet
+    :param path: the dictionary file
+    :return: frozenset of characters
+    """
+    mtime = _mtime(path)
+    cached = _first_chars.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    start = time.time()
+    if is_loaded(path) or not os.path.exists(path) or path.endswith(BINARY_EXT):
+        chars = frozenset(key[:1] for key in get_dictionary(path).map_dict)
+    else:
+        with io.open(path, "r", encoding="utf-8") as f:
+            chars = frozenset(line.strip()[:1] for line in f)
+        chars = chars - frozenset([''])
+    _first_chars[path] = (mtime, chars, time.time() - start)
+    return chars
+
+
+def load_timings(paths=None):
+    """
+    Get the time spent loading dictionaries
+    :param paths: the dictionary files, None for every file in the registry
+    :return: dict of path to a dict of seconds spent by step: 'load' (parsing
+             or mapping the file), 'index' (building the prefix index) and
+             'first_chars' (reading the key first characters), for the steps done
+    """
+    if paths is None:
+        paths = set(_registry) | set(_first_chars)
+    timings = {}
+    for path in paths:
+        timing = {}
+        if path in _first_chars:
+            timing['first_chars'] = _first_chars[path][2]
+        entry = _registry.get(path)
+        if entry is not None:
+            timing.update(entry.timings)
+        if timing:
+            timings[path] = timing
+    return timings
+
+
+def preload(paths, trie=True):
+    """
+    Parse dictionary files ahead of the first conversion
+    :param paths: the dictionary files
+    :param trie: also build the prefix index of each file
+    :return: None
+    """
+    for path in paths:
+        if trie:
+            get_trie(path)
+        else:
+            get_dictionary(path)
+
+
+def changed_paths(check='mtime'):
+    """
+    Find the dictionaries of the registry whose file changed since it was
+    parsed. Missing files are left out, their dictionaries are kept.
+    :param check: 'mtime' compares the file mtimes; 'hash' also reads every
+                  file and compares its content hash, so a file rewritten with
+                  its mtime kept is found, and one only touched is not. Hashes
+                  are taken from the first check on.
+    :return: list of dictionary files
+    """
+    if check not in ('mtime', 'hash'):
+        raise ValueError('unknown check: {}'.format(check))
+    changed = []
+    for path, entry in list(_registry.items()):
+        try:
+            mtime = _mtime(path)
+            digest = _digest(path) if check == 'hash' else None
+        except (IOError, OSError):
+            continue
+        if check == 'mtime':
+            if mtime != entry.mtime:
+                changed.append(path)
+        elif entry.digest is None and mtime == entry.mtime:
+            entry.digest = digest
+        elif digest != entry.digest:
+            changed.append(path)
+        else:
+            # Only touched, parsing it again would give the same dictionary
+            entry.mtime = mtime
+    return changed
+
+
+def reload(paths):
+    """
+    Parse dictionary files again and swap the new dictionaries into the
+    registry. The files are parsed, and indexed when they were before, with
+    no lock held, so it can run in a background thread while conversions go
+    on. OpenCC instances keep the dictionaries they hold until they reload.
+    :param paths: the dictionary files
+    :return: list of the DictTrie replaced, e.g. for fusion.evict
+    """
+    replaced = []
+    for path in paths:
+        old = _registry.get(path)
+        try:
+            mtime = _mtime(path)
+            # Keep tracking the content hash when it was tracked
+            digest = _digest(path) if old is not None and old.digest is not None else None
+            entry = _load_entry(path, mtime, old is not None and old.trie is not None)
+        except (IOError, OSError):
+            continue
+        entry.digest = digest
+        with _lock:
+            old = _registry.get(path)
+            _registry[path] = entry
+            _first_chars.pop(path, None)
+            # Merges are keyed by the file mtimes, drop the stale ones
+            for key in [key for key in _overlays if any(path in source for source in key
+                                                        if isinstance(source, tuple))]:
+                replaced.append(_overlays.pop(key)[1])
+        if old is not None and old.trie is not None:
+            replaced.append(old.trie)
+    return replaced
+
+
+def evict(paths=None):
+    """
+    Drop dictionaries from the registry, and the fused chains built from
+    them. OpenCC instances already holding them keep working, the next
+    instance parses the files again.
+    :param paths: the dictionary files, None to drop everything
+    :return: None
+    """
+    from . import fusion
+
+    with _lock:
+        dropped = [trie for _, trie in _overlays.values()]
+        _overlays.clear()
+        if paths is None:
+            dropped.extend(entry.trie for entry in _registry.values() if entry.trie is not None)
+            _registry.clear()
+            _first_chars.clear()
+        else:
+            for path in paths:
+                entry = _registry.pop(path, None)
+                if entry is not None and entry.trie is not None:
+                    dropped.append(entry.trie)
+                _first_chars.pop(path, None)
+    fusion.evict(dropped)
+
+
+def cached_paths():
+    """
+    :return: list of the dictionary files currently in the registry
+    """
+    with _lock:
+        return list(_registry)
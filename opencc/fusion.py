@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+##########################################################
+# Conversion chain fusion
+# - Cut the passes over the text of a conversion chain down to the ones that
+#   cannot be merged without changing the result
+# - A dictionary whose keys are all single characters is merged into the
+#   dictionary before it in its group: it converts the characters the
+#   dictionaries before it left unmatched, wherever they are
+# - A stage whose keys are all single characters is composed into the stage
+#   before it: it converts character by character, so it is applied to the
+#   values of that stage, and its keys added for the characters left as is
+# - A later stage with longer keys can match across the outputs of an earlier
+#   one, so it keeps its own pass. The fused chain gives the same result as
+#   the staged one, which verify() (or helper/verify_fusion.py) checks
+##########################################################
+
+import threading
+
+from . import dictionary
+from .trie import DictTrie, convert_group
+
+_fused_cache = {}
+_lock = threading.Lock()
+
+
+def _apply(string, chain):
+    for group in chain:
+        string = convert_group(string, group)
+    return string
+
+
+def _single_chars(trie):
+    """
+    :return: True if every key of trie converting to something is a single character
+    """
+    return all(len(key) == 1 for key, value in trie.map_dict.items() if value)
+
+
+def _plan(chain):
+    """
+    :param chain: list of stages, each a list of DictTrie applied as a group
+    :return: list of passes, each a list of the lists of DictTrie merged into
+             one dictionary and the list of the stages composed into the pass
+    """
+    passes = []
+    for group in chain:
+        if passes and all(_single_chars(trie) for trie in group):
+            passes[-1][1].append(group)
+            continue
+        merged = []
+        for trie in group:
+            if merged and _single_chars(trie):
+                merged[-1].append(trie)
+            else:
+                merged.append([trie])
+        passes.append((merged, []))
+    return passes
+
+
+def _merge(sources):
+    """
+    :param sources: list of (DictTrie, list of the stages applied to its
+                    values), the first one taking precedence
+    :return: DictTrie
+    """
+    map_dict = {}
+    candidates = {}
+    for trie, after in sources:
+        for key, value in trie.map_dict.items():
+            if not value or key in map_dict:
+                continue
+            map_dict[key] = _apply(value, after)
+            if key in trie.candidates:
+                candidates[key] = tuple(_apply(v, after) for v in trie.candidates[key])
+
+    max_len = max([len(key) for key in map_dict] or [1])
+    min_len = min([len(key) for key in map_dict] or [1000])
+    return DictTrie(max_len, min_len, dictionary.pack(map_dict), name='fused', candidates=candidates)
+
+
+def fuse_chain(chain):
+    """
+    Merge the dictionaries of a conversion chain into as few passes as give
+    the same result
+    :param chain: list of stages, each a list of DictTrie applied as a group
+    :return: list of stages, each a list of DictTrie; a DictTrie with nothing
+             merged into it is kept as it is
+    """
+    fused = []
+    for merged, stages in _plan(chain):
+        group = []
+        for index, tries in enumerate(merged):
+            sources = [(trie, stages) for trie in tries]
+            if index == len(merged) - 1:
+                # The characters the group leaves unmatched go through the
+                # composed stages as they are
+                for stage, stage_group in enumerate(stages):
+                    sources.extend((trie, stages[stage + 1:]) for trie in stage_group)
+            group.append(tries[0] if len(sources) == 1 and not stages else _merge(sources))
+        fused.append(group)
+    return fused
+
+
+def get_fused_chain(chain, cache=None):
+    """
+    Get the fused chain of a chain, fusing it on first use
+    :param chain: list of stages, each a list of DictTrie
+    :param cache: the dict keeping the fused chains, None for the shared one;
+                  a DictTrie in the key is kept alive by it
+    :return: list of stages, each a list of DictTrie
+    """
+    if cache is None:
+        cache = _fused_cache
+    key = tuple(tuple(group) for group in chain)
+    fused = cache.get(key)
+    if fused is None:
+        with _lock:
+            fused = cache.get(key)
+            if fused is None:
+                fused = fuse_chain(chain)
+                cache[key] = fused
+    return fused
+
+
+def evict(tries):
+    """
+    Drop the fused prefix indexes built from some prefix indexes, e.g. the ones
+    replaced by dictionary.reload
+    :param tries: iterable of DictTrie
+    :return: None
+    """
+    tries = set(tries)
+    with _lock:
+        for key in [key for key in _fused_cache if any(tries.intersection(group) for group in key)]:
+            del _fused_cache[key]
+
+
+def verify(conversion, lines):
+    """
+    Compare the fused and the staged conversion of some text
+    :param conversion: the conversion name, e.g. 's2twp'
+    :param lines: iterable of strings
+    :return: list of (line, staged result, fused result) that differ
+    """
+    from .opencc import OpenCC
+
+    staged = OpenCC(conversion)
+    fused = OpenCC(conversion, fuse=True)
+    mismatches = []
+    for line in lines:
+        expected = staged.convert(line)
+        result = fused.convert(line)
+        if result != expected:
+            mismatches.append((line, expected, result))
+    return mismatches
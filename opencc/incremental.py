@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+##########################################################
+# Incremental re-conversion of edited text
+# - No dictionary match crosses a separator, so a text is kept as the list
+#   of its (segment + separator) pieces with their conversions, and an edit
+#   only converts again the pieces it touches
+# - An edit returns the matching edit of the converted text, for callers
+#   keeping their own copy of it
+##########################################################
+
+from bisect import bisect_right
+
+from .opencc import iter_segments
+
+
+class IncrementalConversion(object):
+    def __init__(self, opencc, string=''):
+        """
+        init IncrementalConversion. The conversion of opencc is used as it is
+        on every edit, change it and the pieces converted before are stale.
+        :param opencc: the OpenCC converting the text
+        :param string: the initial text
+        :return: None
+        """
+        self.opencc = opencc
+        self._sources = []
+        self._targets = []
+        self._source_starts = []
+        self._target_starts = []
+        self.source_len = 0
+        self.target_len = 0
+        self.edit(0, 0, string)
+
+    @property
+    def source(self):
+        return "".join(self._sources)
+
+    @property
+    def text(self):
+        """
+        The converted text, the same as opencc.convert(self.source)
+        """
+        return "".join(self._targets)
+
+    def _piece_at(self, offset):
+        return min(max(bisect_right(self._source_starts, offset) - 1, 0), len(self._sources) - 1)
+
+    def _convert_pieces(self, string):
+        sources = []
+        targets = []
+        for segment, separator in iter_segments(string):
+            if segment or separator:
+                sources.append(segment + separator)
+                targets.append(self.opencc.convert(segment) + separator)
+        return sources, targets
+
+    def edit(self, start, end, replacement):
+        """
+        Replace the text between start and end, converting only the pieces of
+        text around the edit
+        :param start: the start offset of the edit in the source text
+        :param end: the end offset of the edit in the source text
+        :param replacement: the new text
+        :return: (start, end, replacement) of the edit of the converted text
+        """
+        if not 0 <= start <= end <= self.source_len:
+            raise ValueError('edit {}:{} out of the text'.format(start, end))
+
+        if self._sources:
+            # The piece starting right after the edit is included, an edit
+            # removing a separator joins it to the pieces before
+            first = self._piece_at(start)
+            last = self._piece_at(end)
+            region_start = self._source_starts[first]
+            target_start = self._target_starts[first]
+            target_end = self._target_starts[last] + len(self._targets[last])
+            region = "".join(self._sources[first:last + 1])
+        else:
+            first = 0
+            last = -1
+            region_start = target_start = target_end = 0
+            region = ''
+        region = region[:start - region_start] + replacement + region[end - region_start:]
+        sources, targets = self._convert_pieces(region)
+
+        source_starts = []
+        target_starts = []
+        source_pos = region_start
+        target_pos = target_start
+        for source, target in zip(sources, targets):
+            source_starts.append(source_pos)
+            target_starts.append(target_pos)
+            source_pos += len(source)
+            target_pos += len(target)
+        source_delta = len(replacement) - (end - start)
+        target_delta = target_pos - target_end
+        tail = slice(last + 1, None)
+        source_starts.extend(pos + source_delta for pos in self._source_starts[tail])
+        target_starts.extend(pos + target_delta for pos in self._target_starts[tail])
+
+        edited = slice(first, None)
+        self._sources[first:last + 1] = sources
+        self._targets[first:last + 1] = targets
+        self._source_starts[edited] = source_starts
+        self._target_starts[edited] = target_starts
+        self.source_len += source_delta
+        self.target_len += target_delta
+        return target_start, target_end, "".join(targets)
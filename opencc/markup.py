@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+##########################################################
+# Markup-aware conversion
+# - A tokenizer per format cuts a document, in one regular expression pass,
+#   into the text to convert and the markup to copy through: tags, comments,
+#   scripts and styles of HTML/XML; code, URLs and inline HTML of Markdown;
+#   the keys of JSON. A JSON string with escapes is decoded, converted and
+#   escaped again
+# - The text spans are joined with a character no dictionary key contains,
+#   converted with a single convert() call and cut apart again, so no match
+#   crosses a span boundary and there is no per-span call overhead
+##########################################################
+
+import json
+import re
+
+FORMAT_HTML = 'html'
+FORMAT_XML = 'xml'
+FORMAT_MARKDOWN = 'markdown'
+FORMAT_JSON = 'json'
+
+# Joins the text spans; control characters are in no dictionary
+_SENTINELS = ('\x00', '\x01', '\x02', '\x03')
+
+# Quoted attribute values may hold '>'
+_TAG = r'<[!?/]?[A-Za-z](?:"[^"]*"|\'[^\']*\'|[^\'">])*>'
+_HTML_SKIP_RE = re.compile(r'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<(script|style)\b[^>]*>.*?</\1\s*>|<[!?][^>]*>|'
+                           + _TAG, re.DOTALL | re.IGNORECASE)
+
+_MD_FENCE_RE = re.compile(r' {0,3}(`{3,}|~{3,})')
+_MD_LIST_RE = re.compile(r' {0,3}(?:[-*+]|\d{1,9}[.)])(?:\s|$)')
+_MD_SKIP_RE = re.compile(r'(`+)(?:[^`\n]|\n(?![ \t]*\n)|(?!\1)`+)*?\1(?!`)'  # code span, within a paragraph
+                         r'|\]\([^()\s]*(?:\([^()\s]*\)[^()\s]*)*(?:\s+"[^"\n]*")?\)'  # link destination
+                         r'|^ {0,3}\[[^\]\n]+\]:[^\n]*'  # link reference definition
+                         r'|<[A-Za-z][A-Za-z0-9+.-]*:[^<>\s]*>'  # autolink
+                         r'|' + _TAG + r'|<!--.*?-->'
+                         r'|(?:https?|ftp)://[^\s<>()]+', re.DOTALL | re.MULTILINE)
+
+_JSON_STRING_RE = re.compile(r'"((?:[^"\\]|\\.)*)"(\s*:)?', re.DOTALL)
+
+
+def _split(document, skip_re):
+    """
+    :return: generator of (text, convert) pieces, the matches of skip_re
+             not converted
+    """
+    pos = 0
+    for match in skip_re.finditer(document):
+        if match.start() > pos:
+            yield document[pos:match.start()], True
+        yield match.group(), False
+        pos = match.end()
+    if pos < len(document):
+        yield document[pos:], True
+
+
+def html_spans(document):
+    """
+    Cut an HTML or XML document into text nodes and markup. Tags with their
+    attributes, comments, declarations, CDATA sections and the content of
+    script and style elements are markup.
+    :param document: the document
+    :return: generator of (text, convert) pieces joining into document
+    """
+    return _split(document, _HTML_SKIP_RE)
+
+
+def markdown_spans(document):
+    """
+    Cut a Markdown document into text and markup. Fenced and indented code
+    blocks, code spans, link destinations, link reference definitions,
+    autolinks, URLs and inline HTML are markup.
+    :param document: the document
+    :return: generator of (text, convert) pieces joining into document
+    """
+    text = []
+    fence = None
+    blank = True
+    in_list = False
+    for line in document.splitlines(True):
+        if fence is not None:
+            yield line, False
+            stripped = line.strip()
+            if stripped.startswith(fence) and not stripped.strip(fence[0]):
+                fence = None
+            continue
+        match = _MD_FENCE_RE.match(line)
+        # An indented block after a blank line is code, unless it continues a list item
+        indented = blank and not in_list and (line.startswith('    ') or line.startswith('\t'))
+        if match or (indented and line.strip()):
+            for piece in _split("".join(text), _MD_SKIP_RE):
+                yield piece
+            text = []
+            yield line, False
+            if match:
+                fence = match.group(1)
+            else:
+                # Keep following lines of the block as code
+                blank = True
+            continue
+        text.append(line)
+        if line.strip():
+            if not (line.startswith(' ') or line.startswith('\t')):
+                in_list = bool(_MD_LIST_RE.match(line))
+            elif _MD_LIST_RE.match(line):
+                in_list = True
+            blank = False
+        else:
+            blank = True
+    for piece in _split("".join(text), _MD_SKIP_RE):
+        yield piece
+
+
+def _json_escape(literal, value):
+    """
+    :param literal: a JSON string as written, without the quotes
+    :param value: the string it decodes to
+    :return: function escaping the conversion of value as literal is escaped:
+             \\uXXXX escapes for non-ASCII characters if literal has any
+    """
+    ensure_ascii = '\\u' in literal
+
+    def escape(converted):
+        if converted == value:
+            return literal
+        return json.dumps(converted, ensure_ascii=ensure_ascii)[1:-1]
+    return escape
+
+
+def json_spans(document):
+    """
+    Cut a JSON document into its string values and the rest: keys, numbers
+    and punctuation. A string value with escape sequences is decoded; its
+    convert is then the function escaping its conversion again.
+    :param document: the document
+    :return: generator of (text, convert) pieces joining into document once
+             the decoded strings are escaped again
+    """
+    pos = 0
+    for match in _JSON_STRING_RE.finditer(document):
+        if match.group(2) is not None:
+            # An object key
+            continue
+        start, end = match.span(1)
+        yield document[pos:start], False
+        literal = match.group(1)
+        if '\\' not in literal:
+            yield literal, True
+        else:
+            try:
+                value = json.loads('"' + literal + '"')
+            except ValueError:
+                # Not valid JSON, copied through
+                yield literal, False
+            else:
+                yield value, _json_escape(literal, value)
+        pos = end
+    yield document[pos:], False
+
+
+TOKENIZERS = {
+    FORMAT_HTML: html_spans,
+    FORMAT_XML: html_spans,
+    FORMAT_MARKDOWN: markdown_spans,
+    FORMAT_JSON: json_spans,
+}
+
+
+def convert_markup(opencc, document, format=FORMAT_HTML):
+    """
+    Convert the text of a document, copying its markup through
+    :param opencc: the OpenCC converting the text
+    :param document: the document
+    :param format: 'html', 'xml', 'markdown' or 'json'
+    :return: the converted document
+    """
+    tokenizer = TOKENIZERS.get(format)
+    if tokenizer is None:
+        raise ValueError('unknown format: {}'.format(format))
+    pieces = list(tokenizer(document))
+    texts = [text for text, convert in pieces if convert]
+    if not texts:
+        return document
+
+    # Decoded JSON strings may hold characters the document only escapes
+    joined = "".join(texts)
+    sentinel = None
+    for char in _SENTINELS:
+        if char not in joined:
+            sentinel = char
+            break
+    if sentinel is not None:
+        converted = opencc.convert(sentinel.join(texts)).split(sentinel)
+    else:
+        converted = [opencc.convert(text) for text in texts]
+
+    result = []
+    converted = iter(converted)
+    for text, convert in pieces:
+        if not convert:
+            result.append(text)
+        elif convert is True:
+            result.append(next(converted))
+        else:
+            result.append(convert(next(converted)))
+    return "".join(result)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+##########################################################
+# Offset maps between a text and its conversion
+# - A map only lists the replaced spans, as (source start, source end,
+#   target start, target end); the text between them is copied through
+#   and only shifted
+# - Each stage of a conversion chain gives a map from its matches, the maps
+#   of consecutive stages are composed; replaced spans of the two stages
+#   that overlap become a single span
+##########################################################
+
+from bisect import bisect_left, bisect_right
+
+
+class OffsetMap(object):
+    def __init__(self, segments=(), source_len=0, target_len=0):
+        """
+        init OffsetMap
+        :param segments: the replaced spans, (source start, source end, target
+                         start, target end) in increasing order
+        :param source_len: the length of the source text
+        :param target_len: the length of the target text
+        :return: None
+        """
+        self.segments = list(segments)
+        self.source_len = source_len
+        self.target_len = target_len
+        self._starts = [segment[0] for segment in self.segments]
+
+    def map_offset(self, offset, end=False):
+        """
+        :param offset: an offset in the source text
+        :param end: whether the offset ends a span; an offset inside a replaced
+                    span maps to the start of its replacement, or to its end
+                    when end is True
+        :return: the offset in the target text
+        """
+        if end:
+            index = bisect_left(self._starts, offset) - 1
+        else:
+            index = bisect_right(self._starts, offset) - 1
+        if index < 0:
+            return offset
+        source_start, source_end, target_start, target_end = self.segments[index]
+        if offset < source_end:
+            return target_end if end else target_start
+        return offset - source_end + target_end
+
+    def map_span(self, start, end):
+        """
+        :param start: the start of a span of the source text
+        :param end: the end of the span
+        :return: (start, end) of the span in the target text, widened to whole
+                 replacements when the span cuts through one
+        """
+        return self.map_offset(start), self.map_offset(end, True)
+
+    def inverse(self):
+        """
+        :return: the OffsetMap from the target text back to the source text
+        """
+        return OffsetMap([(t0, t1, s0, s1) for s0, s1, t0, t1 in self.segments],
+                         self.target_len, self.source_len)
+
+
+def stage_map(matches, source_len):
+    """
+    Build the OffsetMap of one stage from its matches
+    :param matches: the result of trie.match_group
+    :param source_len: the length of the string matched
+    :return: OffsetMap
+    """
+    segments = []
+    shift = 0
+    for start, end, value, _ in matches:
+        target_start = start + shift
+        shift += len(value) - (end - start)
+        segments.append((start, end, target_start, end + shift))
+    return OffsetMap(segments, source_len, source_len + shift)
+
+
+def compose(first, second):
+    """
+    :param first: the OffsetMap from a text A to a text B
+    :param second: the OffsetMap from B to a text C
+    :return: the OffsetMap from A to C
+    """
+    a = first.segments
+    b = second.segments
+    back = first.inverse()
+    segments = []
+    i = j = 0
+    while i < len(a) or j < len(b):
+        # Start with whichever replaced span comes first in B, then take in
+        # every span of either map overlapping it
+        if j == len(b) or (i < len(a) and a[i][2] < b[j][0]):
+            start, end = a[i][2], a[i][3]
+            i += 1
+        else:
+            start, end = b[j][0], b[j][1]
+            j += 1
+        while True:
+            if i < len(a) and a[i][2] < end:
+                end = max(end, a[i][3])
+                i += 1
+            elif j < len(b) and b[j][0] < end:
+                end = max(end, b[j][1])
+                j += 1
+            else:
+                break
+        segments.append(back.map_span(start, end) + second.map_span(start, end))
+    return OffsetMap(segments, first.source_len, second.target_len)
+
+
+def remap_spans(offset_map, spans):
+    """
+    Map many spans of a source text to the converted text
+    :param offset_map: the OffsetMap of the conversion
+    :param spans: iterable of (start, end) in the source text
+    :return: list of (start, end) in the converted text, see OffsetMap.map_span
+    """
+    map_offset = offset_map.map_offset
+    return [(map_offset(start), map_offset(end, True)) for start, end in spans]
@@ -18,39 +18,123 @@ from __future__ import (unicode_literals, division, absolute_import,
 # - Only match once per dictionary
 # - If a dictionary is configured as part of a group, only match once per group
 #   in order of the listed dictionaries
-# - Cache the results of reading a dictionary in self.dict_cache
+# - Cache the results of reading a dictionary in a process-wide registry
+#   shared by all instances (see dictionary.py)
 # - Use "from __future__ import" to allow support for both Python 2.7
 #   and Python >3.2
 ##########################################################
 
-import io
+import bisect
+import errno
 import os
 import json
+import multiprocessing
 import re
+import threading
+import weakref
+from array import array
+from timeit import default_timer as timer
+
+from . import dictionary
+from . import fusion
+from . import offsets
+from .cache import SegmentCache
+from .offsets import OffsetMap
+from .stats import CallRecord, ConversionStats
+from .trie import convert_group, convert_word, join_matches, match_group, match_word, segment
 
 CONFIG_DIR = 'config'
 DICT_DIR = 'dictionary'
 
+# List of sentence separators from OpenCC PhraseExtract.cpp. None of these separators are allowed as
+# part of a dictionary entry. A run of separators is matched at once by a single character class.
+SPLIT_CHARS = r'\s\-,.?!*　，。、；：？！…“”‘’『』「」﹁﹂—－（）《》〈〉～．／＼︒︑︔︓︿﹀︹︺︙︐［﹇］﹈︕︖︰︳︴︽︾︵︶｛︷｝︸﹃﹄【︻】︼'
+SEPARATORS_RE = re.compile('[' + SPLIT_CHARS + ']+')
+# The same with a capture group, for re.split
+SPLIT_CHARS_RE = re.compile('([' + SPLIT_CHARS + ']+)')
+
+# Matching engines: a prefix index scanned once per dictionary, or the
+# original StringTree kept for comparison
+ENGINE_TRIE = 'trie'
+ENGINE_TREE = 'tree'
+ENGINES = (ENGINE_TRIE, ENGINE_TREE)
+
+# Streaming conversion: characters read at a time from a file object, and
+# the most characters held back waiting for a separator
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_MAX_BUFFER = 1024 * 1024
+
+# Batch conversion: the number of strings sent to a worker process at a time
+BATCH_CHUNK_SIZE = 64
+
+# Counters returned by OpenCC.passthrough_stats
+PASSTHROUGH_STATS = ('segments', 'chars', 'passthrough_segments', 'passthrough_chars')
+
+# Default number of segments kept by OpenCC.set_cache
+SEGMENT_CACHE_SIZE = 10000
+
+# Lazy loading: dictionary files of at least this many bytes are only loaded
+# once the text contains a character one of their keys starts with
+LAZY_DICT_SIZE = 64 * 1024
+
+# Segmentation mode: converted words kept for reuse, dropped all at once when full
+WORD_CACHE_SIZE = 64 * 1024
+
+# The initialized instances, found by reload.py when dictionary files change
+_instances = weakref.WeakSet()
+_instances_lock = threading.Lock()
+
 
 class OpenCC:
-    def __init__(self, conversion=None):
+    def __init__(self, conversion=None, engine=ENGINE_TRIE, fuse=False, lazy=False, segmentation=False):
         """
         init OpenCC
         :param conversion: the conversion of usage, options are
          'hk2s', 's2hk', 's2t', 's2tw', 's2twp', 't2hk', 't2s', 't2tw', 'tw2s', 'tw2sp', etc
-         check the json file names in config directory
+         check the json file names in config directory; or the path of a config file
+        :param engine: the matching engine, 'trie' (default) or 'tree' for the
+         original StringTree algorithm; both give the same result
+        :param fuse: merge the dictionaries of the conversion chain into as few
+         passes over the text as give the same result, see fusion.py
+        :param lazy: defer loading the large dictionaries of the chain until the text
+         contains a character one of their keys starts with; ignored when fusing
+        :param segmentation: cut the text into words once with the segmentation
+         dictionary of the config, and convert word by word, as the C++ OpenCC
+         does; see segment. The result can differ from the default matching.
         :return: None
         """
+        if engine not in ENGINES:
+            raise ValueError('unknown engine: {}'.format(engine))
         self.conversion_name = ''
         self.conversion = conversion
+        self.engine = engine
+        self.fuse = fuse
+        self.lazy = lazy
+        self.segmentation = segmentation
         self._dict_init_done = False
         self._dict_chain = list()
-        self._dict_chain_data = list()
-        self.dict_cache = dict()
-        # List of sentence separators from OpenCC PhraseExtract.cpp. None of these separators are allowed as
-        # part of a dictionary entry
-        self.split_chars_re = re.compile(
-            r'(\s+|-|,|\.|\?|!|\*|　|，|。|、|；|：|？|！|…|“|”|‘|’|『|』|「|」|﹁|﹂|—|－|（|）|《|》|〈|〉|～|．|／|＼|︒|︑|︔|︓|︿|﹀|︹|︺|︙|︐|［|﹇|］|﹈|︕|︖|︰|︳|︴|︽|︾|︵|︶|｛|︷|｝|︸|﹃|﹄|【|︻|】|︼)')
+        # The loaded chain, replaced as a whole by _init_dict
+        self._chain_state = _ChainState([], [], [], {}, {}, frozenset())
+        self._passthrough_stats = dict.fromkeys(PASSTHROUGH_STATS, 0)
+        # Optional memo of converted segments, see set_cache
+        self._segment_cache = None
+        # Optional instrumentation, see enable_stats
+        self.stats = None
+        # (stage, dictionary file or dictionary.UserDictionary), see add_user_dictionary
+        self._user_dicts = []
+        self._overlay_cache = {}
+        # Chains fused with in-memory user dictionaries, see fusion.get_fused_chain
+        self._fused_cache = {}
+        # (config file, its mtime) the chain was built from
+        self._config_stamp = None
+        # The segmentation dictionary file, its merged user dictionaries if
+        # any, and its prefix index once needed, see segment
+        self._segmentation_path = None
+        self._segmentation_overlay = None
+        self._segmentation_trie = None
+        # word -> converted word in segmentation mode
+        self._word_cache = {}
+        self.split_chars_re = SPLIT_CHARS_RE
         if self.conversion is not None:
             self._init_dict()
 
@@ -61,108 +145,871 @@ class OpenCC:
         if not self._dict_init_done:
             self._init_dict()
             self._dict_init_done = True
+        if self.stats is not None:
+            return self._convert_instrumented(string, self.stats)
 
         result = []
-        # Separate string using the list of separators in a regular expression
-        split_string_list = self.split_chars_re.split(string)
-        for i in range(0, len(split_string_list)):
-            if i % 2 == 0:
-                # Work with the text string
-                # Append converted string to result
-                result.append(self._convert(split_string_list[i], self._dict_chain_data))
+        state = self._chain_state
+        chain_data = self._chain_data(state)
+        first_chars = state.first_chars
+        cache = self._segment_cache
+        passthrough_segments = 0
+        passthrough_chars = 0
+        segments = 0
+        # Separate string at the separators
+        for segment, separator in iter_segments(string):
+            segments += 1
+            if first_chars.isdisjoint(segment):
+                # No key can match, copy the segment through
+                passthrough_segments += 1
+                passthrough_chars += len(segment)
+                result.append(segment)
             else:
-                # Work with the separator
-                # Append separator string to converted_string
-                result.append(split_string_list[i])
+                converted = cache.get(segment) if cache is not None else None
+                if converted is None:
+                    converted = self._convert(segment, chain_data)
+                    if cache is not None:
+                        cache.put(segment, converted)
+                # Append converted string to result
+                result.append(converted)
+            # Append separator string to converted_string
+            result.append(separator)
+
+        stats = self._passthrough_stats
+        stats['segments'] += segments
+        stats['chars'] += len(string)
+        stats['passthrough_segments'] += passthrough_segments
+        stats['passthrough_chars'] += passthrough_chars
         # Join it all together to return a result
         return "".join(result)
 
-    def _convert(self, string, dictionary = []):
+    def _convert_instrumented(self, string, stats):
+        """
+        convert() recording the time spent in each stage and dictionary
+        :param string: the input string
+        :param stats: the ConversionStats receiving the CallRecord
+        :return: converted string
+        """
+        call = CallRecord()
+        call_start = timer()
+        call.chars = len(string)
+        call.bytes = len(string.encode('utf-8'))
+
+        start = timer()
+        pieces = list(iter_segments(string))
+        call.stages['split'] = timer() - start
+
+        result = []
+        state = self._chain_state
+        chain_data = self._chain_data(state)
+        first_chars = state.first_chars
+        cache = self._segment_cache
+        passthrough_stats = self._passthrough_stats
+        for segment, separator in pieces:
+            if first_chars.isdisjoint(segment):
+                passthrough_stats['passthrough_segments'] += 1
+                passthrough_stats['passthrough_chars'] += len(segment)
+                result.append(segment)
+            else:
+                converted = cache.get(segment) if cache is not None else None
+                if converted is None:
+                    start = timer()
+                    join = call.stages['join']
+                    load = call.stages['load']
+                    converted = self._convert(segment, chain_data, call)
+                    call.stages['match'] += timer() - start - (call.stages['join'] - join) \
+                        - (call.stages['load'] - load)
+                    if cache is not None:
+                        cache.put(segment, converted)
+                result.append(converted)
+            result.append(separator)
+        passthrough_stats['segments'] += len(pieces)
+        passthrough_stats['chars'] += len(string)
+
+        start = timer()
+        converted = "".join(result)
+        call.stages['join'] += timer() - start
+        call.seconds = timer() - call_start
+        stats.record(call)
+        return converted
+
+    def convert_with_candidates(self, string):
+        """
+        Convert string, keeping the alternatives of the spans converted by a
+        multiple mapping, e.g. for a user to pick the right one. The prefix
+        index engine is used whatever the engine setting.
+        :param string: the input string
+        :return: list of (text, candidates) whose texts join into convert(string);
+                 candidates is the tuple of the alternatives of the span, the
+                 one chosen first, or None for a span with a single conversion
+        """
+        if not self._dict_init_done:
+            self._init_dict()
+            self._dict_init_done = True
+
+        chain = self._match_chain(self._chain_state)
+        result = []
+        for segment, separator in iter_segments(string):
+            result.extend(self._candidate_pieces(segment, chain))
+            result.append((separator, None))
+
+        # Merge the runs of spans without alternatives
+        merged = []
+        for text, candidates in result:
+            if not text:
+                continue
+            if candidates is None and merged and merged[-1][1] is None:
+                merged[-1] = (merged[-1][0] + text, None)
+            else:
+                merged.append((text, candidates))
+        return merged
+
+    def convert_incremental(self, string=''):
+        """
+        Convert a text that is going to be edited, see IncrementalConversion
+        :param string: the initial text
+        :return: incremental.IncrementalConversion, edit() it and read its text
+        """
+        from .incremental import IncrementalConversion
+        return IncrementalConversion(self, string)
+
+    def convert_markup(self, document, format='html'):
+        """
+        Convert the text of an HTML, XML, Markdown or JSON document, leaving
+        its markup as is, see markup.py
+        :param document: the document
+        :param format: 'html', 'xml', 'markdown' or 'json'
+        :return: the converted document
+        """
+        from .markup import convert_markup
+        return convert_markup(self, document, format)
+
+    def convert_with_offsets(self, string):
+        """
+        Convert string, also mapping the offsets of string to those of the
+        result, e.g. to move annotations over. The map is built from the
+        matches of the conversion. The prefix index engine is used whatever
+        the engine setting.
+        :param string: the input string
+        :return: converted string, offsets.OffsetMap from string to it
+        """
+        if not self._dict_init_done:
+            self._init_dict()
+            self._dict_init_done = True
+
+        state = self._chain_state
+        chain = self._match_chain(state)
+        first_chars = state.first_chars
+        result = []
+        segments = []
+        source_pos = 0
+        target_pos = 0
+        for segment, separator in iter_segments(string):
+            converted = segment
+            if not first_chars.isdisjoint(segment):
+                converted, offset_map = self._convert_offsets(segment, chain)
+                segments.extend((s0 + source_pos, s1 + source_pos, t0 + target_pos, t1 + target_pos)
+                                for s0, s1, t0, t1 in offset_map.segments)
+            result.append(converted)
+            result.append(separator)
+            source_pos += len(segment) + len(separator)
+            target_pos += len(converted) + len(separator)
+        return "".join(result), OffsetMap(segments, source_pos, target_pos)
+
+    def _convert_offsets(self, string, chain):
+        """
+        Apply the chain to a segment, composing the offset maps of the stages;
+        word by word in segmentation mode
+        :return: converted string, OffsetMap
+        """
+        if not self.segmentation:
+            return _stage_offsets(string, chain, match_group, self._load_pending)
+
+        result = []
+        segments = []
+        source_pos = 0
+        target_pos = 0
+        for word in segment(string, self._get_segmentation_trie()):
+            converted, offset_map = _stage_offsets(word, chain, match_word, self._load_pending)
+            segments.extend((s0 + source_pos, s1 + source_pos, t0 + target_pos, t1 + target_pos)
+                            for s0, s1, t0, t1 in offset_map.segments)
+            result.append(converted)
+            source_pos += len(word)
+            target_pos += len(converted)
+        return "".join(result), OffsetMap(segments, source_pos, target_pos)
+
+    def _match_chain(self, state):
+        """
+        :param state: the _ChainState of the conversion
+        :return: the chain of prefix indexes, for the methods that need the
+                 matches of the conversion
+        """
+        if state.trie_data:
+            return state.trie_data
+        # The tree engine has no prefix indexes, use the shared ones
+        chain = [[dictionary.get_trie(path) for path in (item if isinstance(item, list) else [item])]
+                 for item in state.dict_chain]
+        for stage, (_, overlay_trie) in state.overlays.items():
+            chain[stage][0] = overlay_trie
+        return chain
+
+    def _candidate_pieces(self, string, chain):
+        """
+        Apply the chain to a segment, keeping track of the alternatives; word
+        by word in segmentation mode, see _stage_candidates
+        :return: list of (text, candidates)
+        """
+        if not self.segmentation:
+            return _stage_candidates(string, chain, match_group, self._load_pending)
+        pieces = []
+        for word in segment(string, self._get_segmentation_trie()):
+            pieces.extend(_stage_candidates(word, chain, match_word, self._load_pending))
+        return pieces
+
+    def enable_stats(self, stats=None):
+        """
+        Record the time spent in each stage of every conversion, and per dictionary
+        the time spent, probes and matches. Without stats, convert() takes a path
+        with no instrumentation at all.
+        :param stats: the ConversionStats to record into, None for a new one;
+                      can be shared by several converters
+        :return: the ConversionStats
+        """
+        if stats is None:
+            stats = ConversionStats()
+        self.stats = stats
+        return stats
+
+    def disable_stats(self):
+        """
+        Stop recording stats
+        :return: None
+        """
+        self.stats = None
+
+    def passthrough_stats(self):
+        """
+        Get how much of the converted text was copied through without matching,
+        since the converter was created or the stats were reset
+        :return: dict with the counts of 'segments' and 'chars' converted, and of
+                 'passthrough_segments' and 'passthrough_chars' copied through
+        """
+        return dict(self._passthrough_stats)
+
+    def set_cache(self, max_entries=SEGMENT_CACHE_SIZE, max_bytes=None):
+        """
+        Keep the conversions of recently seen segments in a bounded LRU cache.
+        The cache is emptied whenever the conversion chain changes.
+        :param max_entries: the most segments kept, 0 disables the cache
+        :param max_bytes: the most memory used by the kept strings, None for no limit
+        :return: None
+        """
+        if max_entries == 0:
+            self._segment_cache = None
+        else:
+            self._segment_cache = SegmentCache(max_entries, max_bytes)
+
+    def cache_stats(self):
+        """
+        :return: dict of the segment cache 'hits', 'misses', 'evictions', 'entries'
+                 and 'bytes', or None if the cache is disabled
+        """
+        if self._segment_cache is None:
+            return None
+        return self._segment_cache.stats()
+
+    def reset_passthrough_stats(self):
+        """
+        Reset the counts returned by passthrough_stats
+        :return: None
+        """
+        self._passthrough_stats = dict.fromkeys(PASSTHROUGH_STATS, 0)
+
+    def convert_stream(self, stream, chunk_size=STREAM_CHUNK_SIZE, max_buffer=STREAM_MAX_BUFFER,
+                       workers=1):
+        """
+        Convert a stream of text piece by piece, holding only a bounded buffer in memory.
+        Text is only cut after a separator, where convert() splits it anyway, so the
+        result is the same as converting the whole text at once, unless a run of more
+        than max_buffer characters has no separator at all; such a run is cut at
+        max_buffer characters.
+        :param stream: a file object opened in text mode or an iterable of strings
+        :param chunk_size: the number of characters read at a time from a file object
+        :param max_buffer: the most characters held back waiting for a separator
+        :param workers: the number of worker processes converting the pieces,
+                        None for one per CPU, 1 converts in this process
+        :return: generator of converted strings
+        """
+        pieces = self._stream_pieces(stream, chunk_size, max_buffer)
+        if workers == 1:
+            for piece in pieces:
+                yield self.convert(piece)
+            return
+
+        pool = self._create_pool(workers)
+        try:
+            # Hand the pool a bounded window of pieces at a time; Pool.imap
+            # would otherwise read the whole stream ahead
+            window_size = (workers or multiprocessing.cpu_count()) * BATCH_CHUNK_SIZE
+            window = []
+            for piece in pieces:
+                window.append(piece)
+                if len(window) == window_size:
+                    for converted in pool.imap(_worker_convert, window):
+                        yield converted
+                    window = []
+            for converted in pool.imap(_worker_convert, window):
+                yield converted
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _stream_pieces(self, stream, chunk_size, max_buffer):
+        """
+        Cut a stream of text right after separators
+        :return: generator of strings
+        """
+        if hasattr(stream, 'read'):
+            chunks = iter(lambda: stream.read(chunk_size), '')
+        else:
+            chunks = stream
+
+        buffer = ''
+        for chunk in chunks:
+            pieces, buffer = self._stream_feed(buffer, chunk, max_buffer)
+            for piece in pieces:
+                yield piece
+        if buffer:
+            yield buffer
+
+    def _stream_feed(self, buffer, chunk, max_buffer):
+        """
+        Add a chunk to the buffer and cut off the pieces it completes: up to
+        the last separator, then max_buffer characters at a time while the
+        rest outgrows it
+        :param buffer: the text held back, which never holds a separator
+        :param chunk: the next chunk of the stream
+        :param max_buffer: the most characters held back
+        :return: list of the pieces cut off, the new buffer
+        """
+        pieces = []
+        # Only the new chunk can hold a separator
+        cut = 0
+        for match in self.split_chars_re.finditer(chunk):
+            cut = match.end()
+        if cut:
+            pieces.append(buffer + chunk[:cut])
+            buffer = chunk[cut:]
+        else:
+            buffer += chunk
+        while len(buffer) > max_buffer:
+            pieces.append(buffer[:max_buffer])
+            buffer = buffer[max_buffer:]
+        return pieces, buffer
+
+    def convert_batch(self, texts, workers=None, chunksize=BATCH_CHUNK_SIZE):
+        """
+        Convert many strings in a pool of worker processes
+        :param texts: iterable of strings
+        :param workers: the number of worker processes, None for one per CPU,
+                        1 converts in this process
+        :param chunksize: the number of strings sent to a worker at a time
+        :return: list of converted strings, in the order of texts
+        """
+        if workers == 1:
+            return [self.convert(text) for text in texts]
+
+        pool = self._create_pool(workers)
+        try:
+            return pool.map(_worker_convert, texts, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+    def convert_many(self, texts, workers=1):
+        """
+        Convert many strings, each distinct one once, in a few large calls,
+        see columns.py
+        :param texts: iterable of strings; other values such as None are
+                      returned as they are
+        :param workers: the number of worker processes converting the distinct
+                        strings, None for one per CPU, 1 converts in this process
+        :return: list of converted strings, in the order of texts
+        """
+        from .columns import convert_many
+        return convert_many(self, texts, workers)
+
+    def convert_series(self, values, workers=1):
+        """
+        Convert a column of strings like convert_many, without a Python
+        round-trip per element where the column type allows it
+        :param values: a pandas Series, Index or string array, a NumPy array,
+                       a pyarrow Array or ChunkedArray, or any other iterable
+        :param workers: see convert_many
+        :return: the converted column, of the same kind, index and dtype as
+                 values; a list for other iterables
+        """
+        from .columns import convert_series
+        return convert_series(self, values, workers)
+
+    def _create_pool(self, workers):
+        """
+        Create a process pool whose workers each hold a converter for this conversion.
+        The dictionaries are loaded here first, so forked workers inherit them
+        instead of loading them again.
+        :param workers: the number of worker processes, None for one per CPU
+        :return: multiprocessing.Pool
+        """
+        if not self._dict_init_done:
+            self._init_dict()
+        return multiprocessing.Pool(workers, _worker_init,
+                                    (self.conversion, self.engine, self.fuse, self.lazy, self._user_dicts,
+                                     self.segmentation))
+
+    def _convert(self, string, dictionary = [], call=None):
         """
         Convert string from Simplified Chinese to Traditional Chinese or vice versa
         If a dictionary is part of a group of dictionaries, stop conversion on a word
         after the first match is found.
         :param string: the input string
         :param dictionary: list of dictionaries to be applied against the string
+        :param call: the stats.CallRecord to record into, None when not instrumented
         :return: converted string
         """
+        if self.segmentation:
+            return self._convert_words(string, dictionary, call)
+        if self.engine == ENGINE_TRIE:
+            for c_dict in dictionary:
+                if _has_pending(c_dict):
+                    c_dict = self._load_pending(c_dict, string, call)
+                string = convert_group(string, c_dict, call)
+            return string
+
+        if call is not None:
+            return self._convert_tree_instrumented(string, dictionary, call)
         tree = StringTree(string)
         for c_dict in dictionary:
+            if _has_pending(c_dict):
+                c_dict = self._load_pending(c_dict, "".join(tree.inorder()))
             tree.create_parse_tree(c_dict)
             tree = StringTree("".join(tree.inorder()))
         return "".join(tree.inorder())
 
+    def _convert_words(self, string, chain, call=None):
+        """
+        _convert() in segmentation mode: cut string into words once, then
+        apply each stage of the chain to every word on its own
+        :param string: the input string
+        :param chain: the chain of prefix indexes
+        :param call: the stats.CallRecord to record the load time into
+        :return: converted string
+        """
+        # Taken once, a reload swaps in a new one
+        word_cache = self._word_cache
+        words = segment(string, self._get_segmentation_trie())
+        result = []
+        for word in words:
+            converted = word_cache.get(word)
+            if converted is None:
+                converted = word
+                for group in chain:
+                    if _has_pending(group):
+                        group = self._load_pending(group, converted, call)
+                    converted = convert_word(converted, group)
+                if len(word_cache) >= WORD_CACHE_SIZE:
+                    word_cache.clear()
+                word_cache[word] = converted
+            result.append(converted)
+        return "".join(result)
+
+    def _get_segmentation_trie(self):
+        """
+        :return: the DictTrie of the segmentation dictionary
+        """
+        trie = self._segmentation_trie
+        if trie is None:
+            trie = self._segmentation_overlay
+            if trie is None:
+                trie = dictionary.get_trie(self._segmentation_path)
+            self._segmentation_trie = trie
+        return trie
+
+    def segment(self, string):
+        """
+        Cut string into words by forward maximum matching with the
+        segmentation dictionary of the config: from left to right the longest
+        word of the dictionary, the characters between words making one word.
+        Separators are words of their own.
+        :param string: the input string
+        :return: list of words joining into string
+        """
+        if not self._dict_init_done:
+            self._init_dict()
+            self._dict_init_done = True
+
+        trie = self._get_segmentation_trie()
+        words = []
+        for piece, separator in iter_segments(string):
+            words.extend(segment(piece, trie))
+            if separator:
+                words.append(separator)
+        return words
+
+    def _convert_tree_instrumented(self, string, dictionary, call):
+        """
+        _convert() with the tree engine, recording each group of the chain as one
+        dictionary named after its position; probes are not counted
+        """
+        tree = StringTree(string)
+        for index, c_dict in enumerate(dictionary):
+            if _has_pending(c_dict):
+                c_dict = self._load_pending(c_dict, "".join(tree.inorder()), call)
+            start = timer()
+            tree.create_parse_tree(c_dict)
+            call.add_dict('stage{}'.format(index), timer() - start, 0, 0)
+            start = timer()
+            tree = StringTree("".join(tree.inorder()))
+            call.stages['join'] += timer() - start
+        start = timer()
+        string = "".join(tree.inorder())
+        call.stages['join'] += timer() - start
+        return string
+
+    def _load_pending(self, group, string, call=None):
+        """
+        Load the not yet loaded dictionaries of a group that may match string
+        :param group: a group of the chain the conversion holds
+        :param string: the string the group is about to be applied against
+        :param call: the stats.CallRecord to record the load time into
+        :return: the loaded dictionaries of the group
+        """
+        loaded = []
+        for c_dict in group:
+            if isinstance(c_dict, _PendingDictionary):
+                if c_dict.first_chars.isdisjoint(string):
+                    continue
+                start = timer()
+                c_dict = self._load_dictionary(c_dict)
+                if call is not None:
+                    call.stages['load'] += timer() - start
+            loaded.append(c_dict)
+        return loaded
+
+    def _load_dictionary(self, pending):
+        """
+        Load a pending dictionary and put it in place in the chain it is from
+        :param pending: the _PendingDictionary
+        :return: the loaded dictionary, in the form used by the current engine
+        """
+        state = pending.state
+        with state.lock:
+            # Otherwise already loaded by another thread
+            if pending.path in state.pending:
+                for chain_data, load in ((state.dict_data, dictionary.get_dictionary),
+                                         (state.trie_data, dictionary.get_trie)):
+                    for group in chain_data:
+                        for index, c_dict in enumerate(group):
+                            if c_dict is pending:
+                                group[index] = load(pending.path)
+                del state.pending[pending.path]
+        if self.engine == ENGINE_TRIE or self.segmentation:
+            return dictionary.get_trie(pending.path)
+        return dictionary.get_dictionary(pending.path)
+
+    def load_timings(self):
+        """
+        Get the time spent loading the dictionaries of the conversion chain
+        :return: dict of dictionary file to a dict of seconds spent by step, see
+                 dictionary.load_timings; dictionaries not loaded yet are left out
+        """
+        return dictionary.load_timings(_chain_paths(self._dict_chain))
+
+    def _chain_data(self, state):
+        """
+        :param state: the _ChainState of the conversion
+        :return: the loaded dictionary chain in the form used by the current engine
+        """
+        if self.engine == ENGINE_TRIE or self.segmentation:
+            return state.trie_data
+        return state.dict_data
+
     def _init_dict(self):
         """
-        initialize the dict with chosen conversion
+        initialize the dict with chosen conversion. The new chain is built
+        aside and swapped in at the end, so a conversion running meanwhile
+        goes on with the chain it started with.
         :return: None
         """
         if self.conversion is None:
             raise ValueError('conversion is not set')
 
-        self._dict_chain = []
-        config = self.conversion + '.json'
-        config_file = os.path.join(os.path.dirname(__file__), CONFIG_DIR, config)
+        start = timer()
+        dict_chain = []
+        if self.conversion.endswith('.json'):
+            config_file = self.conversion
+        else:
+            config_file = os.path.join(os.path.dirname(__file__), CONFIG_DIR, self.conversion + '.json')
+        config_mtime = os.path.getmtime(config_file)
         with open(config_file) as f:
             setting_json = json.load(f)
 
-        self.conversion_name = setting_json.get('name')
-
         for chain in setting_json.get('conversion_chain'):
-            self._add_dict_chain(self._dict_chain, chain.get('dict'))
+            self._add_dict_chain(dict_chain, chain.get('dict'), os.path.dirname(config_file))
+        overlays = self._get_overlays(dict_chain)
+
+        # Without a segmentation block, segment with the first dictionary
+        segmentation_chain = []
+        segmentation_config = setting_json.get('segmentation') or {}
+        if segmentation_config.get('dict'):
+            self._add_dict_chain(segmentation_chain, segmentation_config['dict'], os.path.dirname(config_file))
+        segmentation_path = _chain_paths(segmentation_chain or dict_chain[:1])[0]
+        segmentation_overlay = None
+        for stage, (path, _) in self._overlay_paths(dict_chain).items():
+            if path == segmentation_path:
+                # User words are words too
+                segmentation_overlay = overlays[stage][1]
+                break
 
-        self._dict_chain_data = []
-        self._add_dictionaries(self._dict_chain, self._dict_chain_data)
+        pending = {}
+        if self.lazy and not self.fuse:
+            # The dictionaries user dictionaries are merged into are needed now
+            merged = set(path for path, _ in self._overlay_paths(dict_chain).values())
+            for path in _chain_paths(dict_chain):
+                if os.path.exists(path) and os.path.getsize(path) >= LAZY_DICT_SIZE \
+                        and not dictionary.is_loaded(path) and path not in merged:
+                    pending[path] = _PendingDictionary(path, dictionary.get_first_chars(path))
+
+        dict_chain_data = []
+        self._add_dictionaries(dict_chain, dict_chain_data, pending)
         # Make sure all dictionaries are in a list
-        for index, c_dict in enumerate(self._dict_chain_data):
-           if isinstance(c_dict, tuple):
-               self._dict_chain_data[index] = [c_dict]
+        for index, c_dict in enumerate(dict_chain_data):
+           if not isinstance(c_dict, list):
+               dict_chain_data[index] = [c_dict]
+
+        trie_chain_data = []
+        if self.engine == ENGINE_TRIE or self.fuse or self.segmentation:
+            self._add_tries(dict_chain, trie_chain_data, pending)
+            for index, c_trie in enumerate(trie_chain_data):
+                if not isinstance(c_trie, list):
+                    trie_chain_data[index] = [c_trie]
+
+        for stage, (overlay_dict, overlay_trie) in overlays.items():
+            dict_chain_data[stage][0] = overlay_dict
+            if trie_chain_data:
+                trie_chain_data[stage][0] = overlay_trie
+
+        if self.fuse:
+            # Like the merges, a chain fused with in-memory dictionaries is
+            # kept by this instance
+            in_memory = any(isinstance(source, dictionary.UserDictionary) for _, source in self._user_dicts)
+            trie_chain_data = fusion.get_fused_chain(trie_chain_data, self._fused_cache if in_memory else None)
+            dict_chain_data = [[(c_trie.max_len, c_trie.min_len, c_trie.map_dict) for c_trie in group]
+                               for group in trie_chain_data]
+            first_chars = frozenset(key[:1] for group in trie_chain_data for c_trie in group
+                                    for key in c_trie.map_dict)
+        else:
+            first_chars = set()
+            for path in _chain_paths(dict_chain):
+                first_chars.update(dictionary.get_first_chars(path))
+            for stage in overlays:
+                first_chars.update(key[:1] for key in dict_chain_data[stage][0].map_dict)
+            first_chars = frozenset(first_chars)
+
+        state = _ChainState(dict_chain, dict_chain_data, trie_chain_data, overlays, pending, first_chars)
+        for c_dict in pending.values():
+            c_dict.state = state
+
+        # Swap the new chain in, the loaded chain as a whole
+        self.conversion_name = setting_json.get('name')
+        self._config_stamp = (config_file, config_mtime)
+        self._dict_chain = dict_chain
+        self._chain_state = state
+        self._segmentation_path = segmentation_path
+        self._segmentation_overlay = segmentation_overlay
+        self._segmentation_trie = None
+        self._word_cache = {}
+        current = set(id(overlay) for overlay in overlays.values())
+        self._overlay_cache = dict((key, overlay) for key, overlay in self._overlay_cache.items()
+                                   if id(overlay) in current)
+        self._fused_cache = dict((key, fused) for key, fused in self._fused_cache.items()
+                                 if fused is trie_chain_data)
+        if self._segment_cache is not None:
+            # A new cache rather than clear(), conversions still running on
+            # the old chain would fill it again
+            self._segment_cache = self._segment_cache.renew()
+        with _instances_lock:
+            _instances.add(self)
+        if self.stats is not None:
+            self.stats.record_load(timer() - start)
         self._dict_init_done = True
 
-    def _add_dictionaries(self, chain_list, chain_data):
+    def _add_dictionaries(self, chain_list, chain_data, pending):
         for item in chain_list:
             if isinstance(item, list):
                 chain = []
-                self._add_dictionaries(item, chain)
+                self._add_dictionaries(item, chain, pending)
                 chain_data.append(chain)
+            elif item in pending:
+                chain_data.append(pending[item])
             else:
-                if not item in self.dict_cache:
-                    map_dict = {}
-                    # Default max key length to smallest possible value
-                    max_len = 1
-                    # Default min key length to very large value
-                    min_len = 1000
-                    with io.open(item, "r", encoding="utf-8") as f:
-                        for line in f:
-                            key, value = line.strip().split('\t')
-                            map_dict[key] = value
-                            if len(key) > max_len:
-                                max_len = len(key)
-                            if len(key) < min_len:
-                                min_len = len(key)
-                    chain_data.append((max_len, min_len, map_dict))
-                    self.dict_cache[item] = (max_len, min_len, map_dict)
-                else:
-                    chain_data.append(self.dict_cache[item])
+                chain_data.append(dictionary.get_dictionary(item))
+
+    def _add_tries(self, chain_list, chain_data, pending):
+        """
+        Get the prefix index of every dictionary in chain_list
+        :param chain_list: the dict chain of file names
+        :param chain_data: the list receiving the DictTrie objects
+        :param pending: dict of the dictionaries not loaded yet, by path
+        :return: None
+        """
+        for item in chain_list:
+            if isinstance(item, list):
+                chain = []
+                self._add_tries(item, chain, pending)
+                chain_data.append(chain)
+            elif item in pending:
+                chain_data.append(pending[item])
+            else:
+                chain_data.append(dictionary.get_trie(item))
 
-    def _add_dict_chain(self, dict_chain, dict_dict):
+    def _add_dict_chain(self, dict_chain, dict_dict, config_dir=None):
         """
         add dict chain
         :param dict_chain: the dict chain to add to
         :param dict_dict: the dict to be added in
+        :param config_dir: the directory of the config file, searched for the
+                           dictionary files before the bundled dictionaries
         :return: None
         """
         if dict_dict.get('type') == 'group':
             # Create a sublist of dictionaries for a group
             chain = []
             for dict_item in dict_dict.get('dicts'):
-                self._add_dict_chain(chain, dict_item)
+                self._add_dict_chain(chain, dict_item, config_dir)
             dict_chain.append(chain)
-        elif dict_dict.get('type') == 'txt':
+        elif dict_dict.get('type') in ('txt', 'ocb'):
             filename = dict_dict.get('file')
             dict_file = os.path.join(os.path.dirname(__file__), DICT_DIR, filename)
+            if config_dir is not None:
+                user_file = os.path.join(config_dir, filename)
+                if os.path.exists(user_file) or not os.path.exists(dict_file):
+                    dict_file = user_file
             dict_chain.append(dict_file)
 
+    def _overlay_paths(self, dict_chain=None):
+        """
+        :param dict_chain: the dict chain of file names, None for the current one
+        :return: dict of stage index to the first dictionary file of the stage
+                 and the user dictionaries merged into it
+        """
+        if dict_chain is None:
+            dict_chain = self._dict_chain
+        overlays = {}
+        for stage, source in self._user_dicts:
+            if not 0 <= stage < len(dict_chain):
+                raise ValueError('{} has no stage {}'.format(self.conversion, stage))
+            if stage not in overlays:
+                overlays[stage] = (_chain_paths([dict_chain[stage]])[0], [])
+            overlays[stage][1].append(source)
+        return overlays
+
+    def _get_overlays(self, dict_chain=None):
+        """
+        :param dict_chain: the dict chain of file names, None for the current one
+        :return: dict of stage index to the merged (Dictionary, DictTrie) of
+                 the first dictionary of the stage and its user dictionaries
+        """
+        overlays = {}
+        for stage, (path, sources) in self._overlay_paths(dict_chain).items():
+            # Merges with in-memory dictionaries are kept by this instance, so
+            # they go away with it rather than staying in the registry
+            in_memory = any(isinstance(source, dictionary.UserDictionary) for source in sources)
+            overlays[stage] = dictionary.get_overlay(path, sources, self._overlay_cache if in_memory else None)
+        return overlays
+
+    def reload(self):
+        """
+        Build the conversion chain again from the config file and the
+        dictionary registry, and swap it in. Conversions running meanwhile
+        finish with the chain they started with, conversions never wait on
+        a lock for it. Changed dictionary files not yet parsed again by
+        dictionary.reload are parsed here; see reload.py for doing it in the
+        background.
+        :return: None
+        """
+        if self._dict_init_done:
+            self._init_dict()
+
+    def _config_changed(self):
+        """
+        :return: True if the config file changed since the chain was built
+        """
+        if not self._dict_init_done or self._config_stamp is None:
+            return False
+        config_file, mtime = self._config_stamp
+        try:
+            return os.path.getmtime(config_file) != mtime
+        except OSError:
+            return False
+
+    def _uses(self, paths):
+        """
+        :param paths: set of dictionary files
+        :return: True if the loaded chain uses one of paths
+        """
+        if not self._dict_init_done:
+            return False
+        sources = set(_chain_paths(self._dict_chain))
+        sources.update(source for _, source in self._user_dicts
+                       if not isinstance(source, dictionary.UserDictionary))
+        return not paths.isdisjoint(sources)
+
+    def add_user_dictionary(self, source, stage=0):
+        """
+        Add a user dictionary to a stage of the conversion chain. Its entries
+        are merged, once, into the first dictionary of the stage, overriding
+        the entries with the same key, so converting costs the same as before;
+        a later user dictionary takes precedence over an earlier one. As in
+        any dictionary, a longer match wins over a shorter one. A missing file
+        or a stage the conversion does not have raises here, adding nothing.
+        :param source: a dictionary file, tab separated like the bundled ones
+                       or a .ocb artifact compiled from one; or a dict of keys
+                       to a value or a list of values, or a
+                       dictionary.UserDictionary built from one
+        :param stage: the index of the stage in the conversion chain; the output
+                      of the dictionary still goes through the later stages
+        :return: None
+        """
+        if isinstance(source, dict):
+            source = dictionary.UserDictionary(source)
+        elif not isinstance(source, dictionary.UserDictionary) and \
+                not (os.path.exists(source) or os.path.exists(dictionary.binary_path(source))):
+            raise IOError(errno.ENOENT, os.strerror(errno.ENOENT), source)
+        self._user_dicts.append((stage, source))
+        self._overlay_cache.clear()
+        self._fused_cache.clear()
+        self._dict_init_done = False
+        if self.conversion is not None:
+            # Check the stage and the dictionary now, rather than failing
+            # every conversion from then on
+            try:
+                self._init_dict()
+            except Exception:
+                self._user_dicts.pop()
+                raise
+            self._dict_init_done = True
+
+    def clear_user_dictionaries(self):
+        """
+        Remove the user dictionaries
+        :return: None
+        """
+        if self._user_dicts:
+            self._user_dicts = []
+            self._overlay_cache.clear()
+            self._fused_cache.clear()
+            self._dict_init_done = False
+
     def set_conversion(self, conversion):
         """
         set conversion
@@ -177,68 +1024,274 @@ class OpenCC:
             self._dict_init_done = False
             self.conversion = conversion
 
+    def set_engine(self, engine):
+        """
+        set the matching engine
+        :param engine: 'trie' or 'tree'
+        :return: None
+        """
+        if engine not in ENGINES:
+            raise ValueError('unknown engine: {}'.format(engine))
+        if self.engine == engine:
+            return
+        else:
+            self._dict_init_done = False
+            self.engine = engine
+
+    def set_segmentation(self, segmentation):
+        """
+        set whether the text is cut into words first, see OpenCC.__init__
+        :param segmentation: True or False
+        :return: None
+        """
+        if self.segmentation == segmentation:
+            return
+        else:
+            self._dict_init_done = False
+            self.segmentation = segmentation
+
+    def set_fuse(self, fuse):
+        """
+        set whether the dictionaries of the conversion chain are merged, see fusion.py
+        :param fuse: True or False
+        :return: None
+        """
+        if self.fuse == fuse:
+            return
+        else:
+            self._dict_init_done = False
+            self.fuse = fuse
+
 #############################################
 
-class TreeNode(object):
-    LEFT = 0
-    RIGHT = 1
+def iter_segments(string):
+    """
+    Split string at the separators without building intermediate lists
+    :param string: the input string
+    :return: generator of (segment, separator) pairs, the last separator is ''
+    """
+    pos = 0
+    for match in SEPARATORS_RE.finditer(string):
+        yield string[pos:match.start()], match.group()
+        pos = match.end()
+    yield string[pos:], ''
+
+
+class _ChainState(object):
+    """
+    The loaded conversion chain of an OpenCC. _init_dict builds a new one and
+    swaps it in whole, so a conversion takes it once and goes on with it, even
+    when the chain is reloaded meanwhile.
+    """
+    __slots__ = ('dict_chain', 'dict_data', 'trie_data', 'overlays', 'pending', 'first_chars', 'lock')
+
+    def __init__(self, dict_chain, dict_data, trie_data, overlays, pending, first_chars):
+        """
+        init _ChainState
+        :param dict_chain: the chain of dictionary files
+        :param dict_data: the chain of Dictionary, for the tree engine
+        :param trie_data: the chain of DictTrie, empty when not needed
+        :param overlays: dict of stage to the (Dictionary, DictTrie) of its
+                         merged user dictionaries
+        :param pending: dict of the dictionaries of the chain not loaded yet
+                        in lazy mode, by path
+        :param first_chars: the characters any key of the chain starts with; a
+                            segment without any of them is left as is
+        :return: None
+        """
+        self.dict_chain = dict_chain
+        self.dict_data = dict_data
+        self.trie_data = trie_data
+        self.overlays = overlays
+        self.pending = pending
+        self.first_chars = first_chars
+        self.lock = threading.Lock()
+
+
+class _PendingDictionary(object):
+    """
+    Stands in the loaded chain for a dictionary not loaded yet in lazy mode
+    """
+    __slots__ = ('path', 'first_chars', 'state')
+
+    def __init__(self, path, first_chars):
+        self.path = path
+        self.first_chars = first_chars
+        # The _ChainState holding it
+        self.state = None
+
+
+def _has_pending(group):
+    """
+    :param group: a group of a loaded chain
+    :return: True if a dictionary of the group is not loaded yet
+    """
+    for c_dict in group:
+        if isinstance(c_dict, _PendingDictionary):
+            return True
+    return False
+
+
+def _stage_offsets(string, chain, matcher, load_pending):
+    """
+    Apply the chain to a string, composing the offset maps of the stages
+    :param matcher: match_group, or match_word for a word
+    :param load_pending: the OpenCC._load_pending loading a lazy group
+    :return: converted string, OffsetMap
+    """
+    offset_map = OffsetMap([], len(string), len(string))
+    for group in chain:
+        if _has_pending(group):
+            group = load_pending(group, string)
+        matches = matcher(string, group)
+        if matches:
+            offset_map = offsets.compose(offset_map, offsets.stage_map(matches, len(string)))
+            string = join_matches(string, matches)
+    return string, offset_map
 
-    def __init__(self, value, hint=None):
-        self.branch = [None, None]
-        self.value = value
-        self.matched = False
-        self.length_hint = hint
 
-    def set_matched(self, matched):
-        self.matched = matched
+def _stage_candidates(string, chain, matcher, load_pending):
+    """
+    Apply the chain to a string, keeping track of the alternatives. The
+    alternatives of a span are converted by the later stages that leave
+    the span as a whole unmatched, and replaced by those of a later match
+    overlapping it.
+    :param matcher: match_group, or match_word for a word
+    :param load_pending: the OpenCC._load_pending loading a lazy group
+    :return: list of (text, candidates)
+    """
+    pieces = [(string, None)]
+    for group in chain:
+        if _has_pending(group):
+            group = load_pending(group, string)
+        offsets = []
+        pos = 0
+        for text, _ in pieces:
+            offsets.append(pos)
+            pos += len(text)
 
-    def set_value(self, value):
-        self.value = value
+        new_pieces = []
+        pos = 0
+        for start, end, value, trie in matcher(string, group):
+            _gap_pieces(pieces, offsets, pos, start, group, matcher, new_pieces)
+            new_pieces.append((value, trie.candidates.get(string[start:end])))
+            pos = end
+        _gap_pieces(pieces, offsets, pos, len(string), group, matcher, new_pieces)
+        pieces = new_pieces
+        string = "".join(text for text, _ in pieces)
+    return pieces
 
-    def set_branch(self, branch, node):
-        self.branch[branch] = node
 
-    def set_hint(self, hint):
-        self.length_hint = hint
+def _gap_pieces(pieces, offsets, start, end, group, matcher, result):
+    """
+    Copy the pieces of text a group left unmatched between start and end,
+    cutting the pieces crossing the bounds
+    :param pieces: list of (text, candidates)
+    :param offsets: the start offset of each piece
+    :param group: the group of DictTrie applied, converting the candidates of
+                  the pieces copied whole
+    :param matcher: the function matching the group, see _stage_candidates
+    :param result: the list receiving the pieces
+    :return: None
+    """
+    index = max(bisect.bisect_right(offsets, start) - 1, 0)
+    while index < len(pieces) and offsets[index] < end:
+        text, candidates = pieces[index]
+        piece_start = offsets[index]
+        piece_end = piece_start + len(text)
+        if start <= piece_start and piece_end <= end:
+            if candidates is not None:
+                candidates = tuple(join_matches(c, matcher(c, group)) for c in candidates)
+            result.append((text, candidates))
+        elif piece_end > start:
+            result.append((text[max(start, piece_start) - piece_start:min(end, piece_end) - piece_start], None))
+        index += 1
+
+
+def _chain_paths(dict_chain):
+    """
+    :param dict_chain: a dict chain of file names, possibly nested in groups
+    :return: list of the file names in order
+    """
+    paths = []
+    for item in dict_chain:
+        if isinstance(item, list):
+            paths.extend(_chain_paths(item))
+        else:
+            paths.append(item)
+    return paths
+
+def live_instances():
+    """
+    :return: list of the OpenCC instances alive with their conversion loaded
+    """
+    with _instances_lock:
+        return list(_instances)
+
+# Converter of a worker process started by OpenCC._create_pool
+_worker_opencc = None
+
+
+def _worker_init(conversion, engine, fuse, lazy, user_dicts=(), segmentation=False):
+    global _worker_opencc
+    _worker_opencc = OpenCC(conversion, engine, fuse, lazy, segmentation)
+    for stage, source in user_dicts:
+        _worker_opencc.add_user_dictionary(source, stage)
+
+
+def _worker_convert(string):
+    return _worker_opencc.convert(string)
+
+#############################################
 
 class StringTree(object):
+    """
+    The matches of a group of dictionaries against a string. Rather than a
+    tree of nodes holding copies of the split string, the tree is kept as
+    spans over the original string: the matched spans in arrays and the
+    unmatched ones on a work stack, with no node objects or substring copies.
+    """
     def __init__(self, string):
-        self.root = TreeNode(string)
+        self.string = string
+        # Matched spans: start offsets, end offsets and the replacements
+        self.starts = array('l')
+        self.ends = array('l')
+        self.values = []
 
     def create_parse_tree(self, test_dict_list):
         """
         Compare smaller and smaller sub-strings going from left to
-        rightin root node value against a test_dict_list entry. If match is found,
-        create tree nodes for remaining left and right string portions and place
-        these nodes on a stack for processing.
+        rightin an unmatched span against a test_dict_list entry. If match is found,
+        place the remaining left and right spans on a stack for processing.
 
         :param test_dict_list: a list of tuples of the max key length and dict
                         currently being applied against the string
         """
-        # Stacks to hold nodes with unmatched strings
-        working_stack = [self.root]
-        unmatched_stack =[]
+        # Stacks of unmatched spans, flattened (start, end, length hint) triples
+        working_stack = [0, len(self.string), None]
+        unmatched_stack = []
+        starts = self.starts
+        ends = self.ends
+        values = self.values
 
         # process stack
         for test_dict in test_dict_list:
             while working_stack:
-                curr = working_stack.pop()
-                value, lstring, rstring, test_len = self.__findMatch(curr.value, test_dict, curr.length_hint)
+                hint = working_stack.pop()
+                end = working_stack.pop()
+                start = working_stack.pop()
+                match_start, value, test_len = self.__findMatch(start, end, test_dict, hint)
                 if (value):
-                    curr.set_value(value)
-                    curr.set_hint(None)
-                    curr.set_matched(True)
-                    if (lstring):
-                        node = TreeNode(lstring, test_len)
-                        working_stack.append(node)
-                        curr.set_branch(TreeNode.LEFT, node)
-                    if (rstring):
-                        node = TreeNode(rstring, test_len)
-                        working_stack.append(node)
-                        curr.set_branch(TreeNode.RIGHT, node)
+                    match_end = match_start + test_len
+                    starts.append(match_start)
+                    ends.append(match_end)
+                    values.append(value)
+                    if match_start > start:
+                        working_stack += (start, match_start, test_len)
+                    if match_end < end:
+                        working_stack += (match_end, end, test_len)
                 else:
-                    unmatched_stack.append(curr)
-                    curr.length_hint = None
+                    unmatched_stack += (start, end, None)
             # swap stacks
             temp = working_stack
             working_stack = unmatched_stack
@@ -246,64 +1299,51 @@ class StringTree(object):
 
     def inorder(self):
         """
-        Do a non-recursive inorder traversal of the tree.
+        Join the matched spans with the unmatched text between them, in order.
         :return: list of strings
         """
+        string = self.string
+        starts = self.starts
+        ends = self.ends
+        values = self.values
         return_val = []
-        stack = []
-        curr = self.root
-
-        while True:
-            while curr:
-                stack.append(curr)
-                curr = curr.branch[TreeNode.LEFT]
-
-            if stack:
-                curr = stack.pop()
-                return_val.append(curr.value)
-                curr = curr.branch[TreeNode.RIGHT]
-            else:
-                break
+        pos = 0
+        for index in sorted(range(len(starts)), key=starts.__getitem__):
+            start = starts[index]
+            if start > pos:
+                return_val.append(string[pos:start])
+            return_val.append(values[index])
+            pos = ends[index]
+        return_val.append(string[pos:])
         return return_val
 
-    def __findMatch(self, string, test_dict, hint = None):
+    def __findMatch(self, start, end, test_dict, hint = None):
         """
         Compare smaller and smaller sub-strings going from left to
         right against test_dict. If an entry is found, return it as well
-        as the remaining string(s) and the test length.
+        as where it starts and the test length.
 
-        :param cstring:  the string to find a match
+        :param start: the start of the span to find a match in
+        :param end: the end of the span
         :param test_dict: a tuple of the max key length and dict currently being
                           applied against the string
-        :return: the new matched value, old string to left of the match, old string to right
-                of the match (may be all None if no match found), last test length
+        :return: the start of the match, the new matched value (None if no match
+                found), last test length
         """
-        string_len = len(string)
-        lstring = None
-        rstring = None
-        test_len = min (string_len, test_dict[0])
+        string = self.string
+        map_dict = test_dict[2]
+        test_len = min (end - start, test_dict[0])
         if hint:
             test_len = min (test_len, hint)
         min_len = test_dict[1]
         while test_len >= min_len:
             # Loop through trying successively smaller substrings in the dictionary
-            for i in range(0, string_len - test_len + 1):
-                if string[i:i+test_len] in test_dict[2]:
-                    # Match found.
-                    if i > 0:
-                        # Put everything to the left of the match into lstring
-                        lstring = string[:i]
-                    if (i+test_len) < string_len:
-                        # Put everything to the right of the match into rstring
-                        rstring = string[i+test_len:]
-                    # Save the dictionary value
-                    value = test_dict[2][string[i:i+test_len]]
-                    if len(value.split(' ')) > 1:
-                        # multiple mapping, use the first one for now
-                        value = value.split(' ')[0]
-                    return value, lstring, rstring, test_len
+            for i in range(start, end - test_len + 1):
+                value = map_dict.get(string[i:i+test_len])
+                if value is not None:
+                    # Match found. Multiple mappings were split at load time,
+                    # value is the primary one
+                    return i, value, test_len
             test_len -= 1
         # No match found
-        return None, None, None, None
-
-
+        return None, None, None
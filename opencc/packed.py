@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+##########################################################
+# Packed dictionary storage, for processes forked after loading
+# - A dict holds a str object per key and value. Reading a value updates its
+#   reference count, which writes to the memory page holding it, so a forked
+#   worker ends up with a private copy of most pages of every dictionary
+# - PackedMap keeps the keys and the values in two strings, with arrays of
+#   their offsets and an open addressing hash table of entry numbers: a few
+#   objects per dictionary, which lookups only read
+##########################################################
+
+from array import array
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    from collections import Mapping
+
+# Most table slots per entry in use, as a power of two: 1/4 full keeps
+# missed lookups, the common case when scanning text, at about one probe
+_LOAD_SHIFT = 2
+
+
+def _offsets(strings):
+    offsets = array(str('I'), [0])
+    pos = 0
+    for string in strings:
+        pos += len(string)
+        offsets.append(pos)
+    return offsets
+
+
+class PackedMap(Mapping):
+    """
+    A read-only mapping of strings to strings stored in a few large objects
+    """
+    __slots__ = ('_keys', '_key_offsets', '_values', '_value_offsets', '_table', '_mask')
+
+    def __init__(self, keys, values):
+        """
+        init PackedMap
+        :param keys: list of distinct keys
+        :param values: list of their values
+        :return: None
+        """
+        self._keys = "".join(keys)
+        self._key_offsets = _offsets(keys)
+        self._values = "".join(values)
+        self._value_offsets = _offsets(values)
+        size = 8
+        while size < len(keys) << _LOAD_SHIFT:
+            size <<= 1
+        mask = size - 1
+        table = array(str('i'), [-1]) * size
+        for index, key in enumerate(keys):
+            slot = hash(key) & mask
+            while table[slot] >= 0:
+                slot = (slot + 1) & mask
+            table[slot] = index
+        self._table = table
+        self._mask = mask
+
+    @classmethod
+    def from_dict(cls, mapping):
+        """
+        :param mapping: dict of keys to values
+        :return: PackedMap
+        """
+        return cls(list(mapping), list(mapping.values()))
+
+    def _find(self, key):
+        """
+        :return: the entry number of key, -1 if it is not in the map
+        """
+        table = self._table
+        mask = self._mask
+        keys = self._keys
+        offsets = self._key_offsets
+        slot = hash(key) & mask
+        index = table[slot]
+        while index >= 0:
+            if keys[offsets[index]:offsets[index + 1]] == key:
+                return index
+            slot = (slot + 1) & mask
+            index = table[slot]
+        return -1
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __getitem__(self, key):
+        index = self._find(key)
+        if index < 0:
+            raise KeyError(key)
+        offsets = self._value_offsets
+        return self._values[offsets[index]:offsets[index + 1]]
+
+    def get(self, key, default=None):
+        index = self._find(key)
+        if index < 0:
+            return default
+        offsets = self._value_offsets
+        return self._values[offsets[index]:offsets[index + 1]]
+
+    def __len__(self):
+        return len(self._key_offsets) - 1
+
+    def __iter__(self):
+        keys = self._keys
+        offsets = self._key_offsets
+        for index in range(len(offsets) - 1):
+            yield keys[offsets[index]:offsets[index + 1]]
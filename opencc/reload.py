@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+##########################################################
+# Hot reload of dictionary and config files
+# - The files of the dictionary registry are checked for changes by mtime,
+#   or content hash; the changed ones are parsed again, and indexed, off the
+#   conversion path, then swapped into the registry
+# - Every live OpenCC using a changed file, or whose config file changed,
+#   then builds its chain again and swaps it in; conversions running
+#   meanwhile finish on the old chain and conversions take no lock
+##########################################################
+
+import threading
+
+from . import dictionary
+from . import fusion
+from .opencc import live_instances
+
+# Seconds between two checks of a Reloader
+RELOAD_INTERVAL = 5.0
+
+
+def reload_changed(check='mtime'):
+    """
+    Reload the changed dictionary files and the OpenCC instances using them
+    or whose config file changed
+    :param check: how dictionary changes are found, 'mtime' or 'hash', see
+                  dictionary.changed_paths; config files are checked by mtime
+    :return: sorted list of the dictionary and config files found changed
+    """
+    changed = set(dictionary.changed_paths(check))
+    if changed:
+        fusion.evict(dictionary.reload(changed))
+    reloaded = set(changed)
+    for opencc in live_instances():
+        if opencc._config_changed():
+            reloaded.add(opencc._config_stamp[0])
+        elif not opencc._uses(changed):
+            continue
+        opencc.reload()
+    return sorted(reloaded)
+
+
+class Reloader(object):
+    def __init__(self, interval=RELOAD_INTERVAL, check='mtime', callback=None):
+        """
+        init Reloader, checking for changes in a background thread once started
+        :param interval: seconds between two checks
+        :param check: 'mtime' or 'hash', see dictionary.changed_paths
+        :param callback: called with the list of the files found changed by a
+                         check that found any, or with the exception a check
+                         raised
+        :return: None
+        """
+        if check not in ('mtime', 'hash'):
+            raise ValueError('unknown check: {}'.format(check))
+        self.interval = interval
+        self.check = check
+        self.callback = callback
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start checking, the first check is done right away
+        :return: None
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop checking, waiting for a check in progress to finish
+        :return: None
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                reloaded = reload_changed(self.check)
+            except Exception as e:
+                # A file being written can fail to parse, try again next time
+                reloaded = e
+            if reloaded and self.callback is not None:
+                self.callback(reloaded)
+            self._stop.wait(self.interval)
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+##########################################################
+# Long-running conversion service
+# - Keeps an OpenCC of every conversion loaded, so callers pay neither the
+#   interpreter start nor the dictionary loading per text
+# - Requests from concurrent clients are queued and converted in batches by
+#   one thread; identical texts of a batch are converted once
+# - Served over HTTP, on a TCP port or a Unix socket, or as line-delimited
+#   JSON on stdin/stdout, see python -m opencc --serve / --stdio
+##########################################################
+
+import json
+import os
+import socket
+import stat
+import threading
+import time
+from collections import deque
+
+try:
+    import queue
+    import socketserver
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    import Queue as queue
+    import SocketServer as socketserver
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from urlparse import urlparse, parse_qs
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+from .opencc import OpenCC, CONFIG_DIR
+
+# Most requests converted in one batch
+MAX_BATCH = 64
+# Number of recent requests the latency percentiles are computed from
+LATENCY_WINDOW = 1000
+
+
+def available_conversions():
+    """
+    :return: the sorted names of the bundled conversions
+    """
+    config_dir = os.path.join(os.path.dirname(__file__), CONFIG_DIR)
+    return sorted(os.path.splitext(name)[0] for name in os.listdir(config_dir) if name.endswith('.json'))
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class _Request(object):
+    __slots__ = ('conversion', 'text', 'received', 'result', 'error', 'done')
+
+    def __init__(self, conversion, text):
+        self.conversion = conversion
+        self.text = text
+        self.received = time.time()
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class ConversionService(object):
+    def __init__(self, conversions=None, max_batch=MAX_BATCH):
+        """
+        init ConversionService, loading every conversion
+        :param conversions: the conversions served, None for all bundled ones
+        :param max_batch: the most requests converted in one batch
+        :return: None
+        """
+        self.max_batch = max_batch
+        self._converters = dict((name, OpenCC(name)) for name in conversions or available_conversions())
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._requests = 0
+        self._batches = 0
+        self._chars = 0
+        self._busy = 0.0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def conversions(self):
+        """
+        :return: the sorted names of the served conversions
+        """
+        return sorted(self._converters)
+
+    def convert(self, conversion, text):
+        """
+        Convert text, waiting for the batch it is part of
+        :param conversion: the conversion name, e.g. 's2t'
+        :param text: the input string
+        :return: converted string
+        """
+        if conversion not in self._converters:
+            raise ValueError('unknown conversion: {}'.format(conversion))
+        if not isinstance(text, text_type):
+            raise TypeError('text must be a string, not {}'.format(type(text).__name__))
+        request = _Request(conversion, text)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            batch = [request for request in batch if request is not None]
+
+            start = time.time()
+            results = {}
+            for request in batch:
+                key = (request.conversion, request.text)
+                try:
+                    if key not in results:
+                        results[key] = self._converters[request.conversion].convert(request.text)
+                    request.result = results[key]
+                except Exception as e:
+                    request.error = e
+            end = time.time()
+
+            try:
+                with self._lock:
+                    self._batches += 1
+                    self._requests += len(batch)
+                    self._chars += sum(len(request.text) for request in batch)
+                    self._busy += end - start
+                    self._latencies.extend(end - request.received for request in batch)
+            except Exception:
+                # Only the metrics are lost; the thread has to keep serving
+                pass
+            finally:
+                for request in batch:
+                    request.done.set()
+            if stop:
+                return
+
+    def status(self):
+        """
+        :return: dict of the service metrics: uptime, requests, batches, chars,
+                 the conversion throughput, queue depth and latency percentiles
+        """
+        with self._lock:
+            latencies = list(self._latencies)
+            return {
+                'uptime_s': time.time() - self._started,
+                'conversions': self.conversions(),
+                'requests': self._requests,
+                'batches': self._batches,
+                'chars': self._chars,
+                'chars_per_s': self._chars / self._busy if self._busy else 0.0,
+                'queued': self._queue.qsize(),
+                'latency_p50_ms': _percentile(latencies, 0.50) * 1000,
+                'latency_p99_ms': _percentile(latencies, 0.99) * 1000,
+            }
+
+    def close(self):
+        """
+        Stop the batching thread once the queued requests are converted
+        :return: None
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    POST /convert/<conversion> (or /convert?config=<conversion>) with the
+    UTF-8 text as body returns the converted text; GET /status returns the
+    service metrics as JSON
+    """
+    def do_GET(self):
+        if urlparse(self.path).path != '/status':
+            return self._reply(404, 'not found\n')
+        self._reply(200, json.dumps(self.server.service.status(), sort_keys=True) + '\n',
+                    'application/json')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.startswith('/convert/'):
+            conversion = url.path[len('/convert/'):]
+        elif url.path == '/convert':
+            conversion = parse_qs(url.query).get('config', [''])[0]
+        else:
+            return self._reply(404, 'not found\n')
+
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            text = self.rfile.read(length).decode('utf-8')
+        except UnicodeDecodeError:
+            return self._reply(400, 'the body is not UTF-8\n')
+        try:
+            result = self.server.service.convert(conversion, text)
+        except ValueError as e:
+            return self._reply(404, '{}\n'.format(e))
+        except Exception as e:
+            return self._reply(500, '{}\n'.format(e))
+        self._reply(200, result)
+
+    def _reply(self, code, body, content_type='text/plain'):
+        body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+if hasattr(socket, 'AF_UNIX'):
+    class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+        def get_request(self):
+            request, _ = self.socket.accept()
+            # BaseHTTPRequestHandler expects a (host, port) client address
+            return request, ('local', 0)
+
+
+def make_server(service, address):
+    """
+    Create the HTTP server of a service
+    :param service: the ConversionService
+    :param address: 'host:port', the path of a Unix socket, or 'unix:' followed
+                    by it, e.g. 'unix:opencc.sock' in the current directory
+    :return: the server, run it with serve_forever()
+    """
+    if address.startswith('unix:'):
+        path = address[len('unix:'):]
+    elif '/' in address or os.sep in address:
+        path = address
+    else:
+        path = None
+
+    if path is not None:
+        if os.path.lexists(path):
+            # A socket left by a previous server; never replace anything else
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise ValueError('{} exists and is not a socket'.format(path))
+            os.remove(path)
+        server = _ThreadingUnixHTTPServer(path, _Handler)
+    else:
+        host, _, port = address.rpartition(':')
+        if not port.isdigit():
+            raise ValueError('invalid address {}: expected host:port, or a socket path '
+                             'such as unix:{}'.format(address, address))
+        server = _ThreadingHTTPServer((host or '127.0.0.1', int(port)), _Handler)
+    server.service = service
+    return server
+
+
+def serve_stdio(service, fin, fout):
+    """
+    Answer line-delimited JSON requests until fin ends.
+    {"config": "s2t", "text": "..."} is answered with {"text": "..."},
+    {"status": true} with the service metrics and failures with {"error": "..."};
+    an "id" member of a request is copied to its answer.
+    :param service: the ConversionService
+    :param fin: text file object the requests are read from
+    :param fout: text file object the answers are written to
+    :return: None
+    """
+    for line in fin:
+        if not line.strip():
+            continue
+        answer = {}
+        try:
+            request = json.loads(line)
+            if 'id' in request:
+                answer['id'] = request['id']
+            if request.get('status'):
+                answer['status'] = service.status()
+            else:
+                answer['text'] = service.convert(request.get('config'), request['text'])
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            answer['error'] = str(e)
+        fout.write(json.dumps(answer, ensure_ascii=False) + '\n')
+        fout.flush()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+##########################################################
+# Opt-in instrumentation of the conversion pipeline
+# - OpenCC.enable_stats() switches convert() to an instrumented path that
+#   records one CallRecord per call; the plain path is left untouched
+# - Stages: 'load' (initializing dictionaries), 'split' (separating the
+#   text), 'match' (applying the dictionaries), 'join' (assembling strings)
+##########################################################
+
+import threading
+from collections import defaultdict
+
+STAGES = ('load', 'split', 'match', 'join')
+
+
+class CallRecord(object):
+    __slots__ = ('chars', 'bytes', 'seconds', 'stages', 'dicts')
+
+    def __init__(self):
+        self.chars = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        # stage name: seconds
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        # dictionary name: [seconds, probes, matches]
+        self.dicts = defaultdict(lambda: [0.0, 0, 0])
+
+    def add_dict(self, name, seconds, probes, matches):
+        counters = self.dicts[name]
+        counters[0] += seconds
+        counters[1] += probes
+        counters[2] += matches
+
+
+class ConversionStats(object):
+    def __init__(self):
+        """
+        init ConversionStats
+        :return: None
+        """
+        self._lock = threading.Lock()
+        self._observers = []
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the cumulative counters
+        :return: None
+        """
+        with self._lock:
+            self.calls = 0
+            self.chars = 0
+            self.bytes = 0
+            self.seconds = 0.0
+            self.stages = dict.fromkeys(STAGES, 0.0)
+            self.dicts = defaultdict(lambda: [0.0, 0, 0])
+            self.last = None
+
+    def add_observer(self, callback):
+        """
+        Call callback with the CallRecord of every instrumented conversion
+        :param callback: function taking a CallRecord
+        :return: None
+        """
+        self._observers.append(callback)
+
+    def remove_observer(self, callback):
+        self._observers.remove(callback)
+
+    def record(self, call):
+        """
+        Add a CallRecord to the cumulative counters and notify the observers
+        :param call: the CallRecord
+        :return: None
+        """
+        with self._lock:
+            self.calls += 1
+            self.chars += call.chars
+            self.bytes += call.bytes
+            self.seconds += call.seconds
+            for stage, seconds in call.stages.items():
+                self.stages[stage] += seconds
+            for name, (seconds, probes, matches) in call.dicts.items():
+                counters = self.dicts[name]
+                counters[0] += seconds
+                counters[1] += probes
+                counters[2] += matches
+            self.last = call
+        for callback in self._observers:
+            callback(call)
+
+    def record_load(self, seconds):
+        """
+        Account for time spent initializing dictionaries outside of a call
+        :param seconds: the time spent
+        :return: None
+        """
+        with self._lock:
+            self.stages['load'] += seconds
+
+    def export(self, prefix='opencc'):
+        """
+        Export the cumulative counters with Prometheus metric names and labels
+        :param prefix: the metric name prefix
+        :return: dict of 'name{label="value"}' to number
+        """
+        with self._lock:
+            metrics = {
+                prefix + '_calls_total': self.calls,
+                prefix + '_chars_total': self.chars,
+                prefix + '_bytes_total': self.bytes,
+                prefix + '_seconds_total': self.seconds,
+            }
+            for stage, seconds in self.stages.items():
+                metrics['{}_stage_seconds_total{{stage="{}"}}'.format(prefix, stage)] = seconds
+            for name, (seconds, probes, matches) in self.dicts.items():
+                labels = '{{dict="{}"}}'.format(name)
+                metrics['{}_dict_seconds_total{}'.format(prefix, labels)] = seconds
+                metrics['{}_dict_probes_total{}'.format(prefix, labels)] = probes
+                metrics['{}_dict_matches_total{}'.format(prefix, labels)] = matches
+            return metrics
+
+    def to_prometheus(self, prefix='opencc'):
+        """
+        :param prefix: the metric name prefix
+        :return: the cumulative counters in the Prometheus text format
+        """
+        return "".join('{} {}\n'.format(name, value) for name, value in sorted(self.export(prefix).items()))
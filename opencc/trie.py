@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+##########################################################
+# Prefix index matching engine
+# - Collect every dictionary match of a string in one left to right pass,
+#   extending a candidate only while it is still a prefix of some key
+# - Resolve the candidates longest first, leftmost on ties, which gives the
+#   same result as the recursive splitting done by StringTree
+# - Forward maximum matching, for the segmentation mode: cut a string into
+#   the longest keys from left to right, then convert each word on its own
+##########################################################
+
+from operator import itemgetter
+from timeit import default_timer as timer
+
+MARK = b'\x01'
+
+
+class DictTrie(object):
+    __slots__ = ('max_len', 'min_len', 'map_dict', 'prefixes', 'name', 'candidates')
+
+    def __init__(self, max_len, min_len, map_dict, prefixes=None, name=None, candidates=None):
+        """
+        Build the prefix index of a dictionary
+        :param max_len: the max key length of the dictionary
+        :param min_len: the min key length of the dictionary
+        :param map_dict: the dictionary mapping keys to their primary value
+        :param prefixes: the proper prefixes of the keys when already known
+        :param name: the name reported by instrumentation, e.g. the file name
+        :param candidates: dict of the keys with several values to the tuple
+                           of all of them, the primary one first
+        """
+        self.name = name
+        self.max_len = max_len
+        self.min_len = min_len
+        self.map_dict = map_dict
+        self.candidates = candidates if candidates is not None else {}
+        # Every proper prefix of a key, so a scan can stop as soon as the
+        # text under it can no longer grow into a key
+        if prefixes is None:
+            prefixes = key_prefixes(map_dict)
+        self.prefixes = frozenset(prefixes)
+
+    def scan(self, string):
+        """
+        Find all keys occurring in string.
+        :param string: the string to scan
+        :return: dict of key length to the list of start offsets, in increasing order
+        """
+        map_dict = self.map_dict
+        prefixes = self.prefixes
+        string_len = len(string)
+        by_len = {}
+        for start in range(string_len):
+            end = start + 1
+            while end <= string_len:
+                part = string[start:end]
+                if part in map_dict:
+                    length = end - start
+                    if length in by_len:
+                        by_len[length].append(start)
+                    else:
+                        by_len[length] = [start]
+                if part not in prefixes:
+                    break
+                end += 1
+        return by_len
+
+    def scan_counted(self, string):
+        """
+        Same as scan, also counting the dictionary probes
+        :param string: the string to scan
+        :return: the result of scan, the number of probes
+        """
+        map_dict = self.map_dict
+        prefixes = self.prefixes
+        string_len = len(string)
+        by_len = {}
+        probes = 0
+        for start in range(string_len):
+            end = start + 1
+            while end <= string_len:
+                part = string[start:end]
+                probes += 1
+                if part in map_dict:
+                    length = end - start
+                    if length in by_len:
+                        by_len[length].append(start)
+                    else:
+                        by_len[length] = [start]
+                if part not in prefixes:
+                    break
+                end += 1
+        return by_len, probes
+
+    def match_prefix(self, string, start, end):
+        """
+        :param string: the string to match
+        :param start: the offset the key has to start at
+        :param end: the offset the key has to end by
+        :return: the length of the longest key at start, 0 if there is none
+        """
+        map_dict = self.map_dict
+        prefixes = self.prefixes
+        limit = min(end, start + self.max_len)
+        longest = 0
+        pos = start + 1
+        while pos <= limit:
+            part = string[start:pos]
+            if part in map_dict:
+                longest = pos - start
+            if part not in prefixes:
+                break
+            pos += 1
+        return longest
+
+
+def key_prefixes(keys):
+    """
+    :param keys: the dictionary keys
+    :return: set of every proper prefix of the keys
+    """
+    prefixes = set()
+    for key in keys:
+        for i in range(1, len(key)):
+            prefixes.add(key[:i])
+    return prefixes
+
+
+def match_group(string, tries, call=None):
+    """
+    Find the matches of a group of dictionaries in string. Each dictionary
+    only matches what the previous dictionaries of the group left unmatched.
+    :param string: the input string
+    :param tries: list of DictTrie
+    :param call: the stats.CallRecord receiving per dictionary timings and
+                 counts, None to skip instrumentation
+    :return: list of (start, end, value, DictTrie) of the matches, in order
+    """
+    string_len = len(string)
+    occupied = bytearray(string_len)
+    matches = []
+    for trie in tries:
+        if call is None:
+            by_len = trie.scan(string)
+        else:
+            start_time = timer()
+            by_len, probes = trie.scan_counted(string)
+            matched = len(matches)
+        map_dict = trie.map_dict
+        for length in sorted(by_len, reverse=True):
+            for start in by_len[length]:
+                end = start + length
+                if occupied.find(MARK, start, end) >= 0:
+                    continue
+                value = map_dict[string[start:end]]
+                if not value:
+                    continue
+                occupied[start:end] = MARK * length
+                matches.append((start, end, value, trie))
+        if call is not None:
+            call.add_dict(trie.name, timer() - start_time, probes, len(matches) - matched)
+    # Matches never overlap, so the start offsets alone order them
+    matches.sort(key=itemgetter(0))
+    return matches
+
+
+def convert_group(string, tries, call=None):
+    """
+    Apply a group of dictionaries against string. Each dictionary only
+    converts what the previous dictionaries of the group left unmatched.
+    :param string: the input string
+    :param tries: list of DictTrie
+    :param call: the stats.CallRecord receiving per dictionary timings and
+                 counts, None to skip instrumentation
+    :return: converted string
+    """
+    return join_matches(string, match_group(string, tries, call))
+
+
+def join_matches(string, matches):
+    """
+    :param string: the input string
+    :param matches: the result of match_group on string
+    :return: string with the matches replaced by their values
+    """
+    if not matches:
+        return string
+
+    result = []
+    pos = 0
+    for start, end, value, _ in matches:
+        result.append(string[pos:start])
+        result.append(value)
+        pos = end
+    result.append(string[pos:])
+    return "".join(result)
+
+
+def segment(string, trie):
+    """
+    Cut string into words by forward maximum matching: from left to right,
+    the longest key of the dictionary. The characters between keys make one
+    word, so later stages can still match phrases among them.
+    :param string: the input string
+    :param trie: the DictTrie of the segmentation dictionary
+    :return: list of words joining into string
+    """
+    words = []
+    string_len = len(string)
+    unmatched = 0
+    pos = 0
+    while pos < string_len:
+        length = trie.match_prefix(string, pos, string_len)
+        if length:
+            if unmatched < pos:
+                words.append(string[unmatched:pos])
+            words.append(string[pos:pos + length])
+            pos += length
+            unmatched = pos
+        else:
+            pos += 1
+    if unmatched < string_len:
+        words.append(string[unmatched:])
+    return words
+
+
+def convert_word(word, tries):
+    """
+    Convert a word by forward maximum matching against a group of
+    dictionaries: from left to right, the longest key of the first
+    dictionary having a key there
+    :param word: a word, see segment
+    :param tries: list of DictTrie
+    :return: converted word
+    """
+    result = []
+    word_len = len(word)
+    pos = 0
+    while pos < word_len:
+        for trie in tries:
+            # match_prefix inlined, keeping the value
+            map_dict = trie.map_dict
+            prefixes = trie.prefixes
+            limit = min(word_len, pos + trie.max_len)
+            value = None
+            end = pos + 1
+            while end <= limit:
+                part = word[pos:end]
+                if part in map_dict:
+                    value = map_dict[part]
+                    length = end - pos
+                if part not in prefixes:
+                    break
+                end += 1
+            if value:
+                result.append(value)
+                pos += length
+                break
+        else:
+            result.append(word[pos])
+            pos += 1
+    return "".join(result)
+
+
+def match_word(word, tries):
+    """
+    Find the matches convert_word replaces in a word
+    :param word: a word, see segment
+    :param tries: list of DictTrie
+    :return: list of (start, end, value, DictTrie) of the matches, in order
+    """
+    matches = []
+    word_len = len(word)
+    pos = 0
+    while pos < word_len:
+        for trie in tries:
+            length = trie.match_prefix(word, pos, word_len)
+            value = trie.map_dict[word[pos:pos + length]] if length else None
+            if value:
+                matches.append((pos, pos + length, value, trie))
+                pos += length
+                break
+        else:
+            pos += 1
+    return matches
@@ -6,7 +6,15 @@
 
 import sys
 import os
+import gc
+import io
+import json
+import shutil
+import socket
+import tempfile
+import threading
 import unittest
+from urllib.request import urlopen
 
 
 class OpenCCTest(unittest.TestCase):
@@ -117,7 +125,597 @@ class OpenCCTest(unittest.TestCase):
         words = '儘'
         self.assertEqual(self.openCC.convert(words), '尽')
 
+    # Matching engine tests
+
+    def test_engines_agree(self):
+        words = '鼠标是一种很常見及常用的電腦输入设备它可以对当前屏幕上的游标进行定位并通过按键和滚轮装置对游标所经过位置的' \
+                '屏幕元素进行操作內存U盘SQL注入'
+        for conversion in ('s2t', 's2twp', 'tw2sp', 'hk2s'):
+            trie = OpenCC(conversion)
+            tree = OpenCC(conversion, engine='tree')
+            self.assertEqual(trie.convert(words), tree.convert(words))
+
+    def test_engine_longest_first(self):
+        # The longest key wins even when a shorter key starts further left
+        group = [(3, 1, {'AB': 'x', 'BCD': 'y', 'A': 'a'})]
+        tree = StringTree('ABCD')
+        tree.create_parse_tree(group)
+        self.assertEqual(''.join(tree.inorder()), 'ay')
+        tries = [DictTrie(*c_dict) for c_dict in group]
+        self.assertEqual(convert_group('ABCD', tries), 'ay')
+
+    def test_set_engine(self):
+        self.openCC.set_conversion('s2t')
+        self.openCC.set_engine('tree')
+        words = '香烟（英语：Cigarette），为烟草制品的一种。'
+        self.assertEqual(self.openCC.convert(words), '香菸（英語：Cigarette），爲菸草製品的一種。')
+        self.assertRaises(ValueError, self.openCC.set_engine, 'dawg')
+
+    # Dictionary registry tests
+
+    def test_shared_dictionaries(self):
+        s2t = OpenCC('s2t')
+        s2twp = OpenCC('s2twp')
+        self.assertIs(s2t._chain_state.trie_data[0][0], s2twp._chain_state.trie_data[0][0])
+        self.assertIs(s2t._chain_state.dict_data[0][0], s2twp._chain_state.dict_data[0][0])
+        with self.assertRaises(TypeError):
+            s2t._chain_state.dict_data[0][0].map_dict['a'] = 'b'
+
+    def test_evict_dictionaries(self):
+        s2t = OpenCC('s2t')
+        path = s2t._dict_chain[0][0]
+        self.assertIn(path, dictionary.cached_paths())
+        dictionary.evict([path])
+        self.assertNotIn(path, dictionary.cached_paths())
+        # Instances holding the evicted dictionary keep working
+        self.assertEqual(s2t.convert('为烟草制品'), '爲菸草製品')
+        dictionary.preload([path])
+        self.assertIsNot(OpenCC('s2t')._chain_state.trie_data[0][0], s2t._chain_state.trie_data[0][0])
+
+    def test_binary_dictionary(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'TWVariants.txt')
+            shutil.copy(os.path.join(os.pardir, 'opencc', 'dictionary', 'TWVariants.txt'), path)
+            artifact = dictionary.compile_dictionary(path)
+            self.assertEqual(artifact, os.path.join(temp_dir, 'TWVariants.ocb'))
+            max_len, min_len, map_dict, candidates, prefixes = dictionary.load_compiled(artifact, path)
+            self.assertEqual((max_len, min_len, map_dict, candidates), dictionary.parse_dictionary(path))
+            # A changed source makes the artifact stale
+            with io.open(path, 'a', encoding='utf-8') as f:
+                f.write('测试\t測試\n')
+            self.assertIsNone(dictionary.load_compiled(artifact, path))
+            self.assertIn('测试', dictionary.load_dictionary(path)[2])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_candidates(self):
+        path = os.path.join(os.pardir, 'opencc', 'dictionary', 'STCharacters.txt')
+        entry = dictionary.get_dictionary(path)
+        self.assertEqual(entry.map_dict['干'], '幹')
+        self.assertEqual(entry.candidates['干'], ('幹', '乾', '干'))
+        self.assertNotIn('头', entry.candidates)
+
+        words = '头发干了，为烟草制品'
+        for cc in (OpenCC('s2t'), OpenCC('s2twp', engine='tree'), OpenCC('s2twp', fuse=True)):
+            pieces = cc.convert_with_candidates(words)
+            self.assertEqual(''.join(text for text, _ in pieces), cc.convert(words))
+            self.assertIn(('幹了', ('幹了', '乾了')), pieces)
+            self.assertEqual(pieces[-1], (cc.convert('，为烟草制品'), None))
+
+    def test_offsets(self):
+        self.openCC.set_conversion('s2twp')
+        words = '鼠标，SQL注入和U盘'
+        converted, offset_map = self.openCC.convert_with_offsets(words)
+        self.assertEqual(converted, self.openCC.convert(words))
+        self.assertEqual(converted, '滑鼠，SQL隱碼攻擊和隨身碟')
+        self.assertEqual(offset_map.map_span(3, 8), (3, 10))
+        # Spans cutting through a replacement are widened to all of it
+        self.assertEqual(remap_spans(offset_map, [(9, 11), (4, 5), (0, 1)]), [(11, 14), (3, 10), (0, 2)])
+        self.assertEqual(offset_map.map_span(8, 9), (10, 11))
+        # The maps of the stages are composed
+        first = offsets.OffsetMap([(0, 2, 0, 3)], 4, 5)
+        second = offsets.OffsetMap([(2, 4, 2, 3), (4, 5, 3, 5)], 5, 5)
+        self.assertEqual(offsets.compose(first, second).segments, [(0, 3, 0, 3), (3, 4, 3, 5)])
+
+    def test_incremental(self):
+        self.openCC.set_conversion('s2twp')
+        words = '鼠标是一种很常见的输入设备，它可以对屏幕上的游标进行定位。'
+        state = self.openCC.convert_incremental(words)
+        converted = state.text
+        self.assertEqual(converted, self.openCC.convert(words))
+        for start, end, replacement in ((2, 2, '和内存'), (0, 0, '用U盘'), (7, 9, '，'), (9, 10, ''),
+                                        (len(words), len(words), '打印机')):
+            words = words[:start] + replacement + words[end:]
+            target_start, target_end, target = state.edit(start, end, replacement)
+            converted = converted[:target_start] + target + converted[target_end:]
+            self.assertEqual(state.source, words)
+            self.assertEqual(converted, self.openCC.convert(words))
+            self.assertEqual(state.text, converted)
+        self.assertRaises(ValueError, state.edit, 0, len(words) + 1, '')
+
+    def test_convert_markup(self):
+        self.openCC.set_conversion('s2twp')
+        html = '<p title="鼠标"><a href="/鼠标">鼠标</a>和内存<!-- 鼠标 --></p><script>var a = "鼠标";</script>'
+        self.assertEqual(self.openCC.convert_markup(html),
+                         '<p title="鼠标"><a href="/鼠标">滑鼠</a>和記憶體<!-- 鼠标 --></p><script>var a = "鼠标";</script>')
+        markdown = '# 鼠标\n\n`鼠标` [鼠标](/鼠标)\n\n```\n鼠标\n```\n\n    鼠标\n\n- 鼠标\n\n    内存\n'
+        self.assertEqual(self.openCC.convert_markup(markdown, 'markdown'),
+                         '# 滑鼠\n\n`鼠标` [滑鼠](/鼠标)\n\n```\n鼠标\n```\n\n    鼠标\n\n- 滑鼠\n\n    記憶體\n')
+        document = '{"鼠标": ["鼠标", 1, "\\u5185存 内存", "a\\"\\n\\u0000"]}'
+        self.assertEqual(self.openCC.convert_markup(document, 'json'),
+                         '{"鼠标": ["滑鼠", 1, "\\u8a18\\u61b6\\u9ad4 \\u8a18\\u61b6\\u9ad4", "a\\"\\n\\u0000"]}')
+        document = json.dumps({'t': '鼠标和内存'})
+        self.assertEqual(json.loads(self.openCC.convert_markup(document, 'json')), {'t': '滑鼠和記憶體'})
+        document = json.dumps({'t': '"鼠标"\n内存'}, ensure_ascii=False)
+        self.assertEqual(self.openCC.convert_markup(document, 'json'), '{"t": "\\"滑鼠\\"\\n記憶體"}')
+        self.assertEqual(self.openCC.convert_markup('\x00鼠标\x01\x02\x03<b>内存</b>'), '\x00滑鼠\x01\x02\x03<b>記憶體</b>')
+        self.assertRaises(ValueError, self.openCC.convert_markup, html, 'rtf')
+
+    def test_convert_many(self):
+        self.openCC.set_conversion('s2twp')
+        texts = ['鼠标', None, '', '内存', '鼠标', 'abc', '\x00鼠标\x01\x02\x03'] * 3
+        expected = ['滑鼠', None, '', '記憶體', '滑鼠', 'abc', '\x00滑鼠\x01\x02\x03'] * 3
+        self.assertEqual(self.openCC.convert_many(texts), expected)
+        self.assertEqual(self.openCC.convert_many(iter(texts[:6])), expected[:6])
+        self.assertEqual(self.openCC.convert_many(texts[:6], workers=2), expected[:6])
+        self.assertEqual(self.openCC.convert_series(tuple(texts)), expected)
+        self.assertEqual(self.openCC.convert_many([]), [])
+
+    def test_packed_storage(self):
+        packed = PackedMap.from_dict({'鼠标': '滑鼠', '内存': '記憶體'})
+        self.assertEqual(len(packed), 2)
+        self.assertEqual(packed['鼠标'], '滑鼠')
+        self.assertEqual(packed.get('鼠'), None)
+        self.assertNotIn('鼠', packed)
+        self.assertEqual(dict(packed.items()), {'鼠标': '滑鼠', '内存': '記憶體'})
+        self.assertRaises(KeyError, packed.__getitem__, '内')
+
+        words = '鼠标是一种很常见及常用的电脑输入设备，头发干了'
+        expected = OpenCC('s2twp').convert(words)
+        dictionary.set_storage('packed')
+        dictionary.evict()
+        try:
+            for engine in ('trie', 'tree'):
+                cc = OpenCC('s2twp', engine)
+                self.assertEqual(cc.convert(words), expected)
+            self.assertEqual(OpenCC('s2twp', fuse=True).convert(words), expected)
+            path = os.path.join(os.pardir, 'opencc', 'dictionary', 'STCharacters.txt')
+            self.assertIsInstance(dictionary.get_trie(path).map_dict, PackedMap)
+            self.assertEqual(dictionary.get_dictionary(path).map_dict['干'], '幹')
+            dictionary.prepare_fork()
+            self.assertRaises(ValueError, dictionary.set_storage, 'blob')
+        finally:
+            dictionary.set_storage('dict')
+            dictionary.evict()
+
+    def test_segment(self):
+        self.openCC.set_conversion('s2t')
+        self.assertEqual(self.openCC.segment('香烟为烟草制品，鼠标'), ['香烟', '为', '烟草', '制品', '，', '鼠标'])
+        self.openCC.set_conversion('s2twp')
+        self.openCC.set_segmentation(True)
+        words = '鼠标是一种很常见及常用的电脑输入设备，它可以对当前屏幕上的游标进行定位。'
+        self.assertEqual("".join(self.openCC.segment(words)), words)
+        converted = '滑鼠是一種很常見及常用的電腦輸入裝置，它可以對當前螢幕上的遊標進行定位。'
+        self.assertEqual(self.openCC.convert(words), converted)
+        self.openCC.set_engine('tree')
+        self.assertEqual(self.openCC.convert(words), converted)
+        # Offsets and candidates follow the words too
+        self.assertEqual(self.openCC.convert('这台笔记本电脑'), '這檯筆記本電腦')
+        self.assertEqual(self.openCC.convert_with_offsets('这台笔记本电脑')[0], '這檯筆記本電腦')
+        self.assertEqual(''.join(text for text, _ in self.openCC.convert_with_candidates('这台笔记本电脑')),
+                         '這檯筆記本電腦')
+        self.openCC.set_segmentation(False)
+        self.assertEqual(self.openCC.convert('这台笔记本电脑'), '這檯膝上型電腦')
+        self.assertEqual(self.openCC.convert(words), converted)
+
+    # User dictionary tests
+
+    def test_user_dictionary(self):
+        self.openCC.set_conversion('s2twp')
+        words = '我们公司的服务器和鼠标，数据库'
+        self.assertEqual(self.openCC.convert(words), '我們公司的伺服器和滑鼠，資料庫')
+        self.openCC.add_user_dictionary({'服务器': '主機', '公司': ['公司', '企業']})
+        self.assertEqual(self.openCC.convert(words), '我們公司的主機和滑鼠，資料庫')
+        self.assertEqual(self.openCC.convert_with_candidates('公司'), [('公司', ('公司', '企業'))])
+        self.openCC.set_engine('tree')
+        self.assertEqual(self.openCC.convert(words), '我們公司的主機和滑鼠，資料庫')
+        self.openCC.clear_user_dictionaries()
+        self.assertEqual(self.openCC.convert(words), '我們公司的伺服器和滑鼠，資料庫')
+        self.assertRaises(ValueError, self.openCC.add_user_dictionary, {'': '空'})
+
+        temp_dir = tempfile.mkdtemp()
+        try:
+            user_dict = os.path.join(temp_dir, 'user.txt')
+            with io.open(user_dict, 'w', encoding='utf-8') as f:
+                f.write('鼠标\t老鼠\n')
+            config = os.path.join(temp_dir, 'custom.json')
+            with io.open(config, 'w', encoding='utf-8') as f:
+                json.dump({'conversion_chain': [{'dict': {'type': 'group', 'dicts': [
+                    {'type': 'txt', 'file': 'user.txt'}, {'type': 'txt', 'file': 'STCharacters.txt'}]}}]}, f)
+            custom = OpenCC(config)
+            self.assertEqual(custom.convert('鼠标和数据库'), '老鼠和數據庫')
+
+            cc = OpenCC('s2t')
+            cc.add_user_dictionary(dictionary.compile_dictionary(user_dict))
+            self.assertEqual(cc.convert('鼠标，香烟'), '老鼠，香菸')
+            cc.add_user_dictionary({'香烟': '洋菸'})
+            self.assertEqual(cc.convert('鼠标，香烟'), '老鼠，洋菸')
+            self.assertRaises(ValueError, cc.add_user_dictionary, user_dict, stage=1)
+            missing = os.path.join(temp_dir, 'missing.txt')
+            with self.assertRaises(IOError) as raised:
+                cc.add_user_dictionary(missing)
+            self.assertEqual(raised.exception.filename, missing)
+            # Neither was added
+            self.assertEqual(cc.convert('鼠标，香烟'), '老鼠，洋菸')
+            # The workers add the same user dictionaries
+            self.assertEqual(cc.convert_batch(['鼠标，香烟'] * 2, workers=2), ['老鼠，洋菸'] * 2)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_reload(self):
+        # A lazy conversion holding the chain from before a reload loads
+        # what it still needs into that chain
+        phrases = OpenCC('s2t')._dict_chain[0][0]
+        dictionary.evict([phrases])
+        for engine in ('trie', 'tree'):
+            lazy = OpenCC('s2t', engine=engine, lazy=True)
+            old_state = lazy._chain_state
+            dictionary.preload([phrases])
+            lazy.reload()
+            self.assertEqual(lazy._chain_state.pending, {})
+            self.assertEqual(lazy._convert('为烟草制品', lazy._chain_data(old_state)), '爲菸草製品')
+            self.assertEqual(old_state.pending, {})
+            self.assertEqual(lazy.convert('为烟草制品'), '爲菸草製品')
+            dictionary.evict([phrases])
+
+        temp_dir = tempfile.mkdtemp()
+        try:
+            user_dict = os.path.join(temp_dir, 'user.txt')
+            config = os.path.join(temp_dir, 'custom.json')
+
+            def write(path, text, mtime):
+                with io.open(path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                os.utime(path, (mtime, mtime))
+
+            def write_config(files, mtime):
+                write(config, json.dumps({'conversion_chain': [{'dict': {'type': 'group', 'dicts': [
+                    {'type': 'txt', 'file': name} for name in files]}}]}), mtime)
+
+            write(user_dict, '鼠标\t老鼠\n', 1000000)
+            write_config(['user.txt', 'STCharacters.txt'], 1000000)
+            cc = OpenCC(config)
+            self.assertEqual(cc.convert('鼠标'), '老鼠')
+            old_chain = cc._chain_state.trie_data
+            self.assertEqual(reload_changed('hash'), [])
+
+            write(user_dict, '鼠标\t滑鼠\n', 1000010)
+            self.assertEqual(reload_changed(), [user_dict])
+            self.assertEqual(cc.convert('鼠标'), '滑鼠')
+            # A conversion still holding the old chain finishes with it
+            self.assertEqual(convert_group('鼠标', old_chain[0]), '老鼠')
+
+            # Touched only, or rewritten keeping the mtime
+            os.utime(user_dict, (1000020, 1000020))
+            self.assertEqual(reload_changed('hash'), [])
+            write(user_dict, '鼠标\t滑鼠标\n', 1000020)
+            self.assertEqual(reload_changed(), [])
+            self.assertEqual(reload_changed('hash'), [user_dict])
+            self.assertEqual(cc.convert('鼠标'), '滑鼠标')
+
+            write_config(['STCharacters.txt'], 1000030)
+            self.assertEqual(reload_changed(), [config])
+            self.assertEqual(cc.convert('鼠标'), '鼠標')
+
+            reloaded = []
+            reloader = Reloader(interval=0.01, callback=reloaded.append)
+            write_config(['user.txt', 'STCharacters.txt'], 1000040)
+            reloader.start()
+            reloader.stop()
+            self.assertEqual(cc.convert('鼠标'), '滑鼠标')
+            self.assertEqual(reloaded, [[config]])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    # Bulk conversion tests
+
+    def test_convert_files(self):
+        self.openCC.set_conversion('s2t')
+        temp_dir = tempfile.mkdtemp()
+        try:
+            source_dir = os.path.join(temp_dir, 'in')
+            os.makedirs(os.path.join(source_dir, 'sub'))
+            sources = [os.path.join(source_dir, 'a.srt'), os.path.join(source_dir, 'sub', 'b.srt'),
+                       os.path.join(source_dir, 'c.txt')]
+            for path in sources:
+                with io.open(path, 'w', encoding='utf-8', newline='') as f:
+                    f.write('1\r\n香烟，为烟草制品\r\n')
+            output_dir = os.path.join(temp_dir, 'out')
+            manifest = os.path.join(temp_dir, 'manifest.json')
+
+            result = convert_files(self.openCC, [source_dir], output_dir, include='*.srt', manifest=manifest,
+                                   window=1)
+            self.assertEqual((result['files'], result['skipped'], result['failed']), (2, 0, []))
+            with io.open(os.path.join(output_dir, 'sub', 'b.srt'), encoding='utf-8', newline='') as f:
+                self.assertEqual(f.read(), '1\r\n香菸，爲菸草製品\r\n')
+            self.assertFalse(os.path.exists(os.path.join(output_dir, 'c.txt')))
+
+            # Unchanged, only touched, then changed
+            result = convert_files(self.openCC, [source_dir], output_dir, include='*.srt', manifest=manifest)
+            self.assertEqual((result['files'], result['skipped']), (0, 2))
+            os.utime(sources[0], (1000000, 1000000))
+            with io.open(sources[1], 'a', encoding='utf-8') as f:
+                f.write('一种')
+            result = convert_files(self.openCC, [source_dir], output_dir, include='*.srt', manifest=manifest)
+            self.assertEqual((result['files'], result['skipped']), (1, 1))
+
+            result = convert_files(self.openCC, [os.path.join(source_dir, '**', '*.srt')], suffix='.hant')
+            self.assertEqual(result['files'], 2)
+            self.assertTrue(os.path.exists(os.path.join(source_dir, 'sub', 'b.hant.srt')))
+            os.chmod(sources[2], 0o640)
+            result = convert_files(self.openCC, [sources[2]], in_place=True)
+            with io.open(sources[2], encoding='utf-8') as f:
+                self.assertEqual(f.read(), '1\n香菸，爲菸草製品\n')
+            if os.name == 'posix':
+                self.assertEqual(os.stat(sources[2]).st_mode & 0o777, 0o640)
+            self.assertRaises(ValueError, convert_files, self.openCC, [source_dir])
+            self.assertRaises(ValueError, convert_files, self.openCC, [source_dir], source_dir)
+            self.assertRaises(ValueError, convert_files, self.openCC, [os.path.join(source_dir, 'sub')], source_dir)
+            # Two inputs with the same output path
+            self.assertRaises(ValueError, convert_files, self.openCC,
+                              [sources[0], os.path.join(temp_dir, 'a.srt')], output_dir)
+            shutil.copytree(os.path.join(source_dir, 'sub'), os.path.join(temp_dir, 'sub2'))
+            self.assertRaises(ValueError, convert_files, self.openCC,
+                              [os.path.join(source_dir, 'sub'), os.path.join(temp_dir, 'sub2')], output_dir)
+            if os.name == 'posix':
+                umask = os.umask(0)
+                os.umask(umask)
+                self.assertEqual(os.stat(os.path.join(output_dir, 'a.srt')).st_mode & 0o777, 0o666 & ~umask)
+            self.assertEqual(sorted(os.listdir(output_dir)), ['a.srt', 'sub'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    # Streaming tests
+
+    def test_convert_stream(self):
+        self.openCC.set_conversion('s2twp')
+        words = '鼠标是一种很常見及常用的電腦输入设备，它可以对当前屏幕上的游标进行定位。內存 U盘SQL注入\n' * 20
+        expected = self.openCC.convert(words)
+        stream = io.StringIO(words)
+        self.assertEqual(''.join(self.openCC.convert_stream(stream, chunk_size=7)), expected)
+        chunks = [words[i:i + 5] for i in range(0, len(words), 5)]
+        self.assertEqual(''.join(self.openCC.convert_stream(chunks)), expected)
+
+    def test_convert_stream_max_buffer(self):
+        self.openCC.set_conversion('s2t')
+        words = '为烟草制品' * 10
+        converted = list(self.openCC.convert_stream([words], max_buffer=8))
+        # A chunk many times max_buffer is cut all the way down
+        self.assertEqual(converted, [self.openCC.convert(words[i:i + 8]) for i in range(0, len(words), 8)])
+        self.assertEqual(''.join(self.openCC.convert_stream([words], max_buffer=100)), '爲菸草製品' * 10)
+
+    # Batch conversion tests
+
+    def test_convert_batch(self):
+        self.openCC.set_conversion('s2twp')
+        texts = ['鼠标是一种很常見及常用的電腦输入设备', '內存', '', 'U盘', 'abc'] * 30
+        expected = [self.openCC.convert(text) for text in texts]
+        self.assertEqual(self.openCC.convert_batch(texts, workers=2, chunksize=7), expected)
+        self.assertEqual(self.openCC.convert_batch(texts, workers=1), expected)
+
+    def test_convert_stream_workers(self):
+        self.openCC.set_conversion('s2t')
+        words = '香烟（英语：Cigarette），为烟草制品的一种。\n' * 200
+        converted = ''.join(self.openCC.convert_stream(io.StringIO(words), chunk_size=16, workers=2))
+        self.assertEqual(converted, self.openCC.convert(words))
+
+    # Chain fusion tests
+
+    def test_fused_chain(self):
+        fused = OpenCC('s2twp', fuse=True)
+        fused.convert('')
+        # STCharacters merged into STPhrases, TWVariants composed into TWPhrases
+        self.assertEqual([len(group) for group in fused._chain_state.trie_data], [1, 1])
+        # TWPhrases matches across the outputs of the first stage
+        self.assertEqual(fused.convert('艺术界面'), OpenCC('s2twp').convert('艺术界面'))
+        words = '香烟（英语：Cigarette），为烟草制品的一种。鼠标是一种很常见及常用的电脑输入设备。'
+        self.assertEqual(fused.convert(words), '香菸（英語：Cigarette），為菸草製品的一種。滑鼠是一種很常見及常用的電腦輸入裝置。')
+        fused.set_engine('tree')
+        self.assertEqual(fused.convert(words), '香菸（英語：Cigarette），為菸草製品的一種。滑鼠是一種很常見及常用的電腦輸入裝置。')
+
+        # A chain fused with an in-memory user dictionary goes away with its instance
+        tenant = OpenCC('s2twp', fuse=True)
+        tenant.add_user_dictionary({'服务器': '主機'})
+        self.assertEqual(tenant.convert('服务器和鼠标'), '主機和滑鼠')
+        del tenant
+        gc.collect()
+        self.assertFalse([key for key in fusion._fused_cache
+                          if any(trie.name.endswith('+user') for group in key for trie in group)])
+        dictionary.evict()
+        self.assertEqual(fusion._fused_cache, {})
+
+    def test_verify_fusion(self):
+        corpus_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+        with io.open(os.path.join(corpus_dir, 'zh_hans.txt'), encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        for conversion in ('s2tw', 's2hk', 's2twp', 'tw2sp'):
+            self.assertEqual(fusion.verify(conversion, lines), [])
+
+    # Lazy loading tests
+
+    def test_lazy_loading(self):
+        phrases = OpenCC('s2t')._dict_chain[0][0]
+        dictionary.evict([phrases])
+        for engine in ('trie', 'tree'):
+            dictionary.evict([phrases])
+            lazy = OpenCC('s2t', engine=engine, lazy=True)
+            self.assertIn(phrases, lazy._chain_state.pending)
+            self.assertEqual(lazy.convert('Cigarette 123'), 'Cigarette 123')
+            self.assertIn(phrases, lazy._chain_state.pending)
+            self.assertNotIn('load', lazy.load_timings()[phrases])
+            self.assertEqual(lazy.convert('香烟（英语：Cigarette），为烟草制品的一种。'),
+                             '香菸（英語：Cigarette），爲菸草製品的一種。')
+            self.assertEqual(lazy._chain_state.pending, {})
+            self.assertIn('load', lazy.load_timings()[phrases])
+
+    # Pass-through tests
+
+    def test_passthrough(self):
+        self.openCC.set_conversion('s2t')
+        self.openCC.convert('')
+        self.openCC.reset_passthrough_stats()
+        words = 'GET /index.html 200, 香烟 12.5ms'
+        self.assertEqual(self.openCC.convert(words), 'GET /index.html 200, 香菸 12.5ms')
+        stats = self.openCC.passthrough_stats()
+        self.assertEqual(stats['chars'], len(words))
+        # 'GET', '/index', 'html', '200', '香烟', '12', '5ms'
+        self.assertEqual(stats['segments'], 7)
+        self.assertEqual(stats['passthrough_segments'], 6)
+        self.assertEqual(stats['passthrough_chars'], 21)
+
+    # Segment cache tests
+
+    def test_segment_cache(self):
+        self.openCC.set_conversion('s2t')
+        self.openCC.set_cache(max_entries=2)
+        words = '香烟，为烟草制品，香烟'
+        self.assertEqual(self.openCC.convert(words), '香菸，爲菸草製品，香菸')
+        self.assertEqual(self.openCC.cache_stats(),
+                         {'hits': 1, 'misses': 2, 'evictions': 0, 'entries': 2,
+                          'bytes': self.openCC.cache_stats()['bytes']})
+        self.openCC.convert('一种')
+        self.assertEqual(self.openCC.cache_stats()['evictions'], 1)
+        # Changing the conversion empties the cache
+        self.openCC.set_conversion('s2hk')
+        self.assertEqual(self.openCC.convert('香烟'), '香煙')
+        self.assertEqual(self.openCC.cache_stats()['entries'], 1)
+        self.openCC.set_cache(0)
+        self.assertIsNone(self.openCC.cache_stats())
+
+    def test_segment_cache_bytes(self):
+        cache = SegmentCache(max_entries=None, max_bytes=400)
+        for i in range(20):
+            cache.put('香烟{}'.format(i), '香菸{}'.format(i))
+        stats = cache.stats()
+        self.assertLessEqual(stats['bytes'], 400)
+        self.assertEqual(stats['entries'] + stats['evictions'], 20)
+        self.assertEqual(cache.get('香烟19'), '香菸19')
+        self.assertIsNone(cache.get('香烟0'))
+
+    def test_stats(self):
+        self.openCC.set_conversion('s2t')
+        stats = self.openCC.enable_stats()
+        calls = []
+        stats.add_observer(calls.append)
+        self.assertEqual(self.openCC.convert('香烟，为烟草制品'), '香菸，爲菸草製品')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0].chars, 8)
+        self.assertEqual(calls[0].bytes, 24)
+        metrics = stats.export()
+        self.assertEqual(metrics['opencc_calls_total'], 1)
+        self.assertEqual(metrics['opencc_dict_matches_total{dict="STPhrases.txt"}'], 3)
+        self.assertGreater(metrics['opencc_dict_probes_total{dict="STCharacters.txt"}'], 0)
+        self.assertIn('opencc_stage_seconds_total{stage="split"}', stats.to_prometheus())
+        self.openCC.set_engine('tree')
+        self.assertEqual(self.openCC.convert('香烟'), '香菸')
+        self.assertIn('opencc_dict_seconds_total{dict="stage0"}', stats.export())
+        self.openCC.disable_stats()
+        self.openCC.convert('香烟')
+        self.assertEqual(len(calls), 2)
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'asyncio.run needs Python 3.7')
+    def test_async_convert(self):
+        import asyncio
+        from concurrent.futures import ProcessPoolExecutor
+        from opencc.aio import AsyncOpenCC
+
+        words = '香烟（英语：Cigarette），为烟草制品的一种。' * 100
+        expected = OpenCC('s2t').convert(words)
+
+        async def convert_all(cc):
+            results = await asyncio.gather(cc.convert('香烟'), cc.convert(words), cc.convert(words))
+            pieces = []
+            async for piece in cc.convert_stream(io.StringIO(words), chunk_size=50):
+                pieces.append(piece)
+            return results, ''.join(pieces)
+
+        cc = AsyncOpenCC('s2t', max_pending=1)
+        results, streamed = asyncio.run(convert_all(cc))
+        self.assertEqual(results, ['香菸', expected, expected])
+        self.assertEqual(streamed, expected)
+        self.assertEqual(cc.in_flight, 0)
+
+        cc = AsyncOpenCC('s2twp', segmentation=True, inline_size=0)
+        self.assertEqual(asyncio.run(cc.convert('这台笔记本电脑')), '這檯筆記本電腦')
+
+        with ProcessPoolExecutor(1) as executor:
+            cc = AsyncOpenCC('s2t', executor=executor, inline_size=0)
+            results, streamed = asyncio.run(convert_all(cc))
+        self.assertEqual(results, ['香菸', expected, expected])
+        self.assertEqual(streamed, expected)
+
+    def test_server(self):
+        service = ConversionService(['s2t', 't2s'])
+        self.assertEqual(service.convert('s2t', '香烟'), '香菸')
+        self.assertRaises(ValueError, service.convert, 'x2y', '香烟')
+
+        server = make_server(service, '127.0.0.1:0')
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+            reply = urlopen(url + '/convert/t2s', '香菸'.encode('utf-8'))
+            self.assertEqual(reply.read().decode('utf-8'), '香烟')
+            status = json.loads(urlopen(url + '/status').read().decode('utf-8'))
+            self.assertEqual(status['requests'], 2)
+            self.assertEqual(status['conversions'], ['s2t', 't2s'])
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        fout = io.StringIO()
+        serve_stdio(service, io.StringIO('{"id": 7, "config": "s2t", "text": "香烟"}\n'
+                                         '{"config": "x2y", "text": ""}\n'
+                                         '{"config": "s2t", "text": 5}\n'
+                                         '{"config": "s2t", "text": "烟草"}\n'), fout)
+        answers = [json.loads(line) for line in fout.getvalue().splitlines()]
+        self.assertEqual(answers[0], {'id': 7, 'text': '香菸'})
+        self.assertIn('error', answers[1])
+        self.assertIn('error', answers[2])
+        # The batching thread survives the malformed request
+        self.assertEqual(answers[3], {'text': '菸草'})
+
+        self.assertRaises(ValueError, make_server, service, 'opencc.sock')
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'opencc.sock')
+            with io.open(path, 'w') as f:
+                f.write('not a socket')
+            self.assertRaises(ValueError, make_server, service, path)
+            self.assertTrue(os.path.isfile(path))
+            os.remove(path)
+            if hasattr(socket, 'AF_UNIX'):
+                make_server(service, 'unix:' + path).server_close()
+                # The socket left behind is replaced
+                make_server(service, path).server_close()
+        finally:
+            shutil.rmtree(temp_dir)
+        service.close()
+
 if __name__ == '__main__':
     sys.path.append(os.pardir)
     from opencc import OpenCC
+    from opencc import dictionary
+    from opencc import fusion
+    from opencc import offsets
+    from opencc.offsets import remap_spans
+    from opencc.packed import PackedMap
+    from opencc.reload import Reloader, reload_changed
+    from opencc.bulk import convert_files
+    from opencc.cache import SegmentCache
+    from opencc.opencc import StringTree
+    from opencc.server import ConversionService, make_server, serve_stdio
+    from opencc.trie import DictTrie, convert_group
     unittest.main()